@@ -1,11 +1,37 @@
-from typing import List
+import contextvars
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, List
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage, AnyMessage, AIMessage
+from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage, AnyMessage, AIMessage, \
+    message_chunk_to_message, messages_from_dict, messages_to_dict
 import streamlit as st
-from ai_core import customer_tools, ticket_tools, employee_tools, statistic_tools
-from utils import helpers
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from ai_core import customer_tools, ticket_tools, employee_tools, statistic_tools, router, models, providers, \
+    scheduler, failover
+from ai_core.context import SUMMARY_HEADER, ContextWindow, estimate_tokens
+from utils import crm_client as crm
+from utils import helpers, tracing, usage
+
+# Tools that modify data. Within one model response they run one at a time, in order, after every read.
+WRITE_TOOLS = {
+    "update_customer_data", "create_new_customer",
+    "update_ticket", "create_new_ticket", "bulk_update_tickets",
+    "update_employee", "create_new_employee",
+}
+
+# Read tools of all sessions share one pool, sized for many sessions working at once.
+TOOL_WORKERS = 32
+# Seconds a read tool may run once it started, and may wait for a free worker before it is given up.
+TOOL_TIMEOUT = 30
+TOOL_QUEUE_TIMEOUT = 30
+
+# Shared by all sessions so the number of tool threads in the process stays bounded. Writes do not use it.
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="crm-tool")
 
 
 class GeminiAssistant:
@@ -13,6 +39,7 @@ class GeminiAssistant:
         customer_tools.update_customer_data, ticket_tools.update_ticket, employee_tools.update_employee,
         customer_tools.get_all_customers, ticket_tools.get_all_tickets, employee_tools.get_all_employees,
         customer_tools.search_customers, ticket_tools.search_ticket, employee_tools.search_employee,
+        customer_tools.resolve_customer, employee_tools.resolve_employee, ticket_tools.bulk_update_tickets,
         customer_tools.create_new_customer, ticket_tools.create_new_ticket, employee_tools.create_new_employee,
         statistic_tools.show_individual_analysis
     ]
@@ -23,29 +50,30 @@ class GeminiAssistant:
         "search_customers": customer_tools.search_customers,
         "get_all_customers": customer_tools.get_all_customers,
         "create_new_customer": customer_tools.create_new_customer,
+        "resolve_customer": customer_tools.resolve_customer,
 
         # tickets tool
         "create_new_ticket": ticket_tools.create_new_ticket,
         "get_all_tickets": ticket_tools.get_all_tickets,
         "search_ticket": ticket_tools.search_ticket,
         "update_ticket": ticket_tools.update_ticket,
+        "bulk_update_tickets": ticket_tools.bulk_update_tickets,
 
         # employee tools
         "create_new_employee": employee_tools.create_new_employee,
         "get_all_employees": employee_tools.get_all_employees,
         "search_employee": employee_tools.search_employee,
         "update_employee": employee_tools.update_employee,
+        "resolve_employee": employee_tools.resolve_employee,
 
         # statistic tools
         "show_individual_analysis": statistic_tools.show_individual_analysis
     }
 
-    MODEL_OPTIONS = {
-        "Gemini": ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-3-flash"],
-        "Groq": ["llama-3.3-70b-versatile", "qwen/qwen3-32b"]
-    }
+    MODEL_OPTIONS = providers.model_options()
 
-    system_prompt = f"""
+    # Filled in per session by build_system_prompt.
+    system_prompt = """
     You are the AI CRM Assistant, a specialized agent designed to help employees manage the company's internal database. Your primary role is to interact with the database using your provided tools to handle Customers, Support Tickets, and Employee records.
 
         ### 1. YOUR CAPABILITIES & TOOLS
@@ -56,7 +84,7 @@ class GeminiAssistant:
         * **Employees:** You can manage employee records and access levels.
         
         ### 2. OPERATIONAL RULES
-        * **Data Presentation:** When displaying lists of data (e.g., "Show all tickets", "Find customers named John"), you must **STRICTLY use a Markdown Table**. Ensure columns align correctly.
+        * **Data Presentation:** Lists and single records returned by the list/search tools are shown to the user automatically as tables and cards. Never re-type their rows or fields; only write a short narrative around them (counts, notable items, next steps).
         * **Missing Information:** Do NOT make up IDs or required fields. If a user asks "Update the ticket" without specifying *which* ticket ID, you must ask: "Which ticket ID would you like to update?"
         * **ID Handling:** IDs are integers. If a user provides an ID like "#8" or "ID: 8", extract just the integer `8` for the tool.
         * **Creation logic:**
@@ -73,48 +101,88 @@ class GeminiAssistant:
         * "Agent" refers to the employee using this system. Address them respectfully.
         
         You are an autonomous agent. If a user requests an action that requires a specific ID (like customer_id) but 
-        only provides a name, you must automatically use your search tools to find that ID. Do not ask the user for 
+        only provides a name, you must automatically use `resolve_customer` / `resolve_employee` to find that ID. Do not ask the user for 
         information you can retrieve yourself. 
         
-        The ID of current Employee is {st.session_state.current_emp}. If the user asks anything while using words like
+        The ID of current Employee is {current_emp}. If the user asks anything while using words like
         me, mine, my , owned by me. etc than consider this id.
         IT matches to assignee_id or created_by_id in tickets table based on the context given. Unless the user mentions,
         it matches to assignee_id
         IT matches to created_by field in customers table.
-        The access of current employee is {st.session_state.access_level}
+        The access of current employee is {access_level}
         
         If the user mentions last or latest ticket, last customer or last employee, understand that he is mentioning the latest
         created record of that type and do any aforementioned operations with that in mind.
         """
 
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
-            api_key=st.secrets["gemini_secret_4"]
-        ).bind_tools(self.llm_tools)
+        # The default model is built on the first message, so the page renders before the provider SDK is imported.
+        self._llm = None
         self.message_history: List[AnyMessage] = []
-        self.message_history.append(SystemMessage(content=self.system_prompt))
+        self.message_history.append(SystemMessage(content=self.build_system_prompt(
+            st.session_state.current_emp, st.session_state.access_level)))
+        self.context = ContextWindow()
+        self.last_artifacts = []
+        self.turn_usage = None
+        self.router = router.IntentRouter(current_emp=st.session_state.current_emp)
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = models.get_model("Gemini", "gemini-2.5-flash-lite", st.secrets["gemini_secret_4"],
+                                         self.llm_tools)
+        return self._llm
+
+    @llm.setter
+    def llm(self, value):
+        self._llm = value
+
+    @classmethod
+    def build_system_prompt(cls, current_emp, access_level) -> str:
+        """
+        :param current_emp: ID of the logged in employee
+        :param access_level: Access level of the logged in employee
+        :return: System prompt for this session
+        """
+        return cls.system_prompt.format(current_emp=current_emp, access_level=access_level)
+
+    def snapshot(self) -> dict:
+        """
+        State needed to continue the conversation after a page reload, see utils.snapshots. Tool results of
+        older exchanges are elided and artifacts dropped, they are already rendered in the persisted chat.
+        The model is not part of it, a model picked with the user's own key needs that key again.
+
+        :return: {"messages": [...], "entity_cache": [...]}, msgpack serializable
+        """
+        history = [m.model_copy(update={"artifact": None}) if isinstance(m, ToolMessage) else m
+                   for m in self.context.elide_old(self.message_history)]
+        return {"messages": messages_to_dict(history), "entity_cache": crm.get_client().cache.dump()}
+
+    def restore(self, state: dict):
+        """
+        Continue from a snapshot. The system prompt is rebuilt for the current employee, the summary of
+        earlier exchanges is kept.
+
+        :param state: State written by snapshot, as loaded by utils.snapshots
+        """
+        history = messages_from_dict(state.get("messages") or [])
+        if not history or not isinstance(history[0], SystemMessage):
+            return
+        _, header, summary = history[0].content.partition(SUMMARY_HEADER)
+        history[0] = SystemMessage(content=self.message_history[0].content + header + summary)
+        self.message_history = history
+        crm.get_client().cache.load(state.get("entity_cache") or [], time.time() - state.get("saved_at", 0))
 
     def config_model(self, model, provider, api_key):
         """
         User can add their own api key for any of the supported model.
         :param model: Any tool supported model
-        :param provider: ["Gemini","Groq"]
+        :param provider: Provider registered in ai_core.providers
         :param api_key: Secret key
         :return:
         """
         try:
-            if provider == "Gemini":
-                self.llm = ChatGoogleGenerativeAI(
-                    model=model,
-                    api_key=api_key
-                ).bind_tools(self.llm_tools)
-            if provider == "Groq":
-                self.llm = ChatGroq(
-                    model=model,
-                    api_key=api_key,
-                    temperature=0.7
-                ).bind_tools(self.llm_tools)
+            self.llm = models.get_model(provider, model, api_key, self.llm_tools)
         except Exception as e:
             st.error("Model unsupported! Please select appropriate model")
 
@@ -122,30 +190,39 @@ class GeminiAssistant:
         """
         This functions is used to send messages to the selected LLM.
         :param prompt: The user Query
-        :return: Response by the LLM for user query
+        :return: Response by the LLM for user query. Tool results to render are left in last_artifacts.
         """
+        with self._turn(prompt) as span:
+            reply = self._send_message(prompt)
+            span.set(reply_bytes=len(reply or ""), artifacts=len(self.last_artifacts))
+            return reply
+
+    def _send_message(self, prompt: str) -> [str, None]:
+        self.message_history = self.context.compact(self.message_history)
         self.message_history.append(HumanMessage(content=prompt))
+        self.last_artifacts = []
+
+        reply, tool_messages = self._fast_path(prompt)
+        self.last_artifacts.extend(m.artifact for m in tool_messages if m.artifact)
+        if reply:
+            return reply
+
         try:
-            ai_msg = self.llm.invoke(self.message_history)
+            ai_msg = self._invoke()
+        except scheduler.Overloaded as e:
+            st.warning(str(e))
+            return None
         except Exception as e:
             st.error(f"Some Error occurred on API side. Please Change API model -  {e}")
             return None
         self.message_history.append(ai_msg)
         while ai_msg.tool_calls:
-            for tool_call in ai_msg.tool_calls:
-                name = tool_call["name"]
-                args = tool_call["args"]
-
-                if name in self.tools_map:
-                    print(f"Executing Tool {name}")
-                    result = self.tools_map[name].invoke(args)
-                    self.message_history.append(
-                        ToolMessage(content=str(result), tool_call_id=tool_call["id"])
-                    )
+            tool_messages = self.execute_tool_calls(ai_msg.tool_calls)
+            self.message_history.extend(tool_messages)
+            self.last_artifacts.extend(m.artifact for m in tool_messages if m.artifact)
             try:
-                ai_msg = self.llm.invoke(self.message_history)
+                ai_msg = self._invoke()
                 self.message_history.append(ai_msg)
-                print(ai_msg)
             except Exception as e:
                 st.error(f"API Error in loop: {e}")
                 break
@@ -155,5 +232,295 @@ class GeminiAssistant:
             self.message_history.append(AIMessage(content=msg))
         return msg
 
+    def stream_message(self, prompt: str) -> Iterator[dict]:
+        """
+        Streaming variant of send_message. Yields events while the turn is in progress:
+          - {"type": "tool", "name": ...} before a tool is executed
+          - {"type": "artifact", "artifact": ...} for every tool result to render in the chat view
+          - {"type": "token", "text": ...} for every piece of text produced by the LLM
+
+        :param prompt: The user Query
+        :return: Generator of events
+        """
+        with self._turn(prompt) as span:
+            yield from self._stream_message(prompt)
+            span.set(artifacts=len(self.last_artifacts))
+
+    def _stream_message(self, prompt: str) -> Iterator[dict]:
+        self.message_history = self.context.compact(self.message_history)
+        self.message_history.append(HumanMessage(content=prompt))
+        self.last_artifacts = []
+
+        reply, tool_messages = self._fast_path(prompt)
+        for message in tool_messages:
+            if message.artifact:
+                self.last_artifacts.append(message.artifact)
+                yield {"type": "artifact", "artifact": message.artifact}
+        if reply:
+            yield {"type": "token", "text": reply}
+            return
+
+        first_call = True
+        shown = False
+        while True:
+            # Text of an earlier call ("Let me check.") is on the page already, start the next on a new paragraph.
+            progress = {"streamed": "", "separator": "\n\n" if shown else ""}
+            gathered = None
+            candidates = failover.chain(self.llm, self.llm_tools)
+            for i, (provider, get) in enumerate(candidates):
+                try:
+                    history = self.message_history if provider == candidates[0][0] \
+                        else failover.portable(self.message_history)
+                    gathered = yield from self._stream_call(get(), history, progress)
+                    break
+                except Exception as e:
+                    # Text already on the page cannot be taken back, fail over only before the first token.
+                    if not progress["streamed"] and i < len(candidates) - 1:
+                        continue
+                    if isinstance(e, scheduler.Overloaded):
+                        st.warning(str(e))
+                    elif first_call:
+                        st.error(f"Some Error occurred on API side. Please Change API model -  {e}")
+                    else:
+                        st.error(f"API Error in loop: {e}")
+                    return
+            first_call = False
+            streamed = progress["streamed"]
+            shown = shown or bool(streamed)
+
+            if gathered is None:
+                break
+            ai_msg = message_chunk_to_message(gathered)
+            self.message_history.append(ai_msg)
+            if not ai_msg.tool_calls:
+                break
+
+            for tool_call in ai_msg.tool_calls:
+                yield {"type": "tool", "name": tool_call["name"]}
+            tool_messages = self.execute_tool_calls(ai_msg.tool_calls)
+            self.message_history.extend(tool_messages)
+            for message in tool_messages:
+                if message.artifact:
+                    self.last_artifacts.append(message.artifact)
+                    yield {"type": "artifact", "artifact": message.artifact}
+
+        if not streamed:
+            msg = "Action completed successfully."
+            self.message_history.append(AIMessage(content=msg))
+            yield {"type": "token", "text": ("\n\n" if shown else "") + msg}
+
+    @contextmanager
+    def _turn(self, prompt: str):
+        """
+        Trace span and token accounting of one turn.
+        """
+        emp, chat_id = st.session_state.get("current_emp"), st.session_state.get("live_chat_id")
+        self.turn_usage = usage.new_turn(prompt, emp, chat_id)
+        try:
+            with tracing.span("turn", "turn", emp=emp, chat_id=chat_id, prompt_bytes=len(prompt)) as span:
+                yield span
+                span.set(input_tokens=self.turn_usage["input_tokens"],
+                         output_tokens=self.turn_usage["output_tokens"], cost_usd=self.turn_usage["cost_usd"])
+        finally:
+            usage.finish_turn(self.turn_usage)
+
+    def _model_name(self, bound=None) -> str:
+        chat_model = bound or self.llm
+        chat_model = getattr(chat_model, "bound", chat_model)
+        return getattr(chat_model, "model", None) or getattr(chat_model, "model_name", type(chat_model).__name__)
+
+    def _llm_span(self, stream: bool = False, bound=None):
+        return tracing.span(self._model_name(bound), "llm", stream=stream, messages=len(self.message_history),
+                            prompt_bytes=sum(len(str(m.content)) for m in self.message_history))
+
+    def _record_usage(self, span, ai_msg: AIMessage, bound=None):
+        span.set(tool_calls=len(ai_msg.tool_calls), response_bytes=len(str(ai_msg.content)),
+                 **(ai_msg.usage_metadata or {}))
+        if self.turn_usage is not None:
+            model = self._model_name(bound)
+            usage.add_call(self.turn_usage, model, ai_msg.usage_metadata, providers.price(model))
+
+    def _llm_key(self, bound=None) -> tuple:
+        """
+        Rate limit lane of a model, the session's by default, see ai_core.scheduler.
+        """
+        return models.key_of(bound or self.llm) or ("", self._model_name(bound), "")
+
+    def _prompt_tokens(self) -> int:
+        return sum(estimate_tokens(m) for m in self.message_history)
+
+    def _invoke(self) -> AIMessage:
+        """
+        One LLM call over the history, failing over along failover.FALLBACK_CHAIN if the model fails.
+        """
+        return failover.invoke(self.llm, self.message_history, self.llm_tools, self._call_model, self._model_name)
+
+    def _call_model(self, bound, messages: list, last: bool = True) -> AIMessage:
+        with self._llm_span(bound=bound) as span:
+            ai_msg = scheduler.call(self._llm_key(bound), id(self), self._prompt_tokens(),
+                                    lambda: bound.invoke(messages), retries=scheduler.MAX_RETRIES if last else 0)
+            self._record_usage(span, ai_msg, bound)
+            return ai_msg
+
+    def _stream_call(self, bound, messages: list, progress: dict):
+        """
+        Streaming counterpart of _call_model. Yields token events and adds the text to progress["streamed"].
+        progress["separator"], if any, is yielded before the first token.
+
+        :return: The gathered chunks, None if the model sent nothing
+        """
+        gathered = None
+        with self._llm_span(stream=True, bound=bound) as span, \
+                scheduler.slot(self._llm_key(bound), id(self), self._prompt_tokens()) as slot:
+            for chunk in bound.stream(messages):
+                gathered = chunk if gathered is None else gathered + chunk
+                text = helpers.get_chunk_text(chunk)
+                if text:
+                    if not progress["streamed"]:
+                        span.set(first_token_ms=round((time.time() - span.start) * 1000, 3))
+                        if progress.get("separator"):
+                            yield {"type": "token", "text": progress["separator"]}
+                    progress["streamed"] += text
+                    yield {"type": "token", "text": text}
+            if gathered is not None:
+                self._record_usage(span, message_chunk_to_message(gathered), bound)
+                slot.settle(gathered.usage_metadata)
+        return gathered
+
+    def _fast_path(self, prompt: str):
+        """
+        Answer a trivial request with a single tool call and no LLM round trip, using the intent router.
+        If the tool result still needs the LLM (an error, nothing to render), the call and its result stay in
+        the history and the LLM continues from there.
+
+        :param prompt: The user Query
+        :return: (reply or None, ToolMessages produced)
+        """
+        if not router.is_enabled():
+            return None, []
+
+        routed = self.router.route(prompt)
+        if routed is None:
+            router.record("misses")
+            return None, []
+
+        name, args = routed
+        tool_call = {"name": name, "args": args, "id": f"fast_path_{uuid.uuid4().hex[:12]}", "type": "tool_call"}
+        ai_msg = AIMessage(content="", tool_calls=[tool_call])
+        tool_messages = self.execute_tool_calls(ai_msg.tool_calls)
+        self.message_history.append(ai_msg)
+        self.message_history.extend(tool_messages)
+
+        result = tool_messages[0]
+        artifact = result.artifact
+        if artifact and artifact["kind"] == "table" and artifact.get("page"):
+            reply = f"Page {artifact['page']} of {name.rsplit('_', 1)[-1]}."
+        elif artifact and artifact["kind"] == "table":
+            reply = f"Found {artifact.get('total', len(artifact['rows']))} result(s)."
+        elif artifact:
+            reply = f"Here are the details of {artifact['title']}."
+        elif name in WRITE_TOOLS and str(result.content).startswith("Successfully"):
+            reply = f"{result.content}."
+        else:
+            router.record("fallbacks")
+            tracing.current_span().set(fast_path="fallback")
+            return None, tool_messages
+
+        router.record("hits")
+        tracing.current_span().set(fast_path="hit")
+        self.message_history.append(AIMessage(content=reply))
+        return reply, tool_messages
+
+    def execute_tool_calls(self, tool_calls: list) -> List[ToolMessage]:
+        """
+        Run the tool calls of one model response. Reads run in parallel on the shared pool, writes run one
+        by one afterwards on the calling thread, so a write never waits for a worker and never outlives a
+        timeout that already told the model it failed. A read that fails or exceeds its timeout becomes an
+        error message for the model.
+
+        :param tool_calls: tool_calls of an AI message
+        :return: One ToolMessage per call, in the same order as tool_calls. Structured results of the tools
+            are kept in ToolMessage.artifact.
+        """
+        ctx = get_script_run_ctx()
+        reads = [i for i, call in enumerate(tool_calls) if call["name"] not in WRITE_TOOLS]
+        writes = [i for i, call in enumerate(tool_calls) if call["name"] in WRITE_TOOLS]
+
+        results = {}
+        pending = {i: self._submit_tool(tool_calls[i], ctx) for i in reads}
+        for i in reads:
+            results[i] = self._tool_result(tool_calls[i], *pending[i])
+        for i in writes:
+            results[i] = self._write_result(tool_calls[i])
+
+        tool_messages = [
+            results[i] if isinstance(results[i], ToolMessage) else
+            ToolMessage(content=str(results[i]), tool_call_id=call["id"])
+            for i, call in enumerate(tool_calls)
+        ]
+        if self.turn_usage is not None:
+            for call, message in zip(tool_calls, tool_messages):
+                usage.add_tool(self.turn_usage, call["name"], estimate_tokens(message))
+        return tool_messages
+
+    def _run_tool(self, tool_call: dict) -> ToolMessage:
+        name = tool_call["name"]
+        with tracing.span(name, "tool", args_bytes=len(json.dumps(tool_call["args"], default=str))) as span:
+            # Invoking with the whole tool call gives back a ToolMessage carrying the tool's artifact.
+            result = self.tools_map[name].invoke({**tool_call, "type": "tool_call"})
+            span.set(result_bytes=len(str(result.content)), artifact=result.artifact is not None)
+            return result
+
+    def _submit_tool(self, tool_call: dict, ctx):
+        """
+        :return: (future, state) - state["started"] is set to the monotonic start time once a worker runs it
+        """
+        state = {"submitted": time.monotonic(), "started": None, "event": threading.Event()}
+        if tool_call["name"] not in self.tools_map:
+            return None, state
+
+        def run():
+            state["started"] = time.monotonic()
+            state["event"].set()
+            # Tools read st.session_state, so the pool thread needs the session's script context.
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return self._run_tool(tool_call)
+
+        # The copied context makes the tool span a child of the current turn.
+        return _tool_executor.submit(contextvars.copy_context().run, run), state
+
+    @staticmethod
+    def _tool_result(tool_call: dict, future, state: dict):
+        name = tool_call["name"]
+        if future is None:
+            return f"Tool {name} does not exist. Use only the tools you were given."
+        queued = state["submitted"] + TOOL_QUEUE_TIMEOUT - time.monotonic()
+        if not state["event"].wait(timeout=max(queued, 0)) and future.cancel():
+            return f"Tool {name} did not run, the assistant is busy. Tell the user to try again in a moment."
+        # Not cancelled, so a worker has picked it up; the timeout counts from there.
+        state["event"].wait()
+        try:
+            return future.result(timeout=max(state["started"] + TOOL_TIMEOUT - time.monotonic(), 0))
+        except TimeoutError:
+            return f"Tool {name} did not respond within {TOOL_TIMEOUT} seconds. Tell the user the CRM is " \
+                   f"responding slowly and ask them to try again."
+        except Exception as e:
+            return f"Tool {name} failed with this error - {e}. Explain the user what went wrong in really short " \
+                   f"summary"
+
+    def _write_result(self, tool_call: dict):
+        """
+        Run a write tool on the calling thread. It is bounded by the CRM client's request timeouts only: a
+        write whose outcome is unknown must not be reported as failed, or the model would repeat it.
+        """
+        name = tool_call["name"]
+        if name not in self.tools_map:
+            return f"Tool {name} does not exist. Use only the tools you were given."
+        try:
+            return self._run_tool(tool_call)
+        except Exception as e:
+            return f"Tool {name} failed with this error - {e}. Do not run it again before checking whether " \
+                   f"the change was made anyway. Explain the user what went wrong in really short summary"
+
     def get_model_options(self):
         return self.MODEL_OPTIONS
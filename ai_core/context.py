@@ -0,0 +1,130 @@
+from typing import List
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+from utils import helpers
+
+# Rough number of characters per token, good enough for budgeting.
+CHARS_PER_TOKEN = 4
+
+SUMMARY_HEADER = "\n\n### SUMMARY OF EARLIER CONVERSATION\n"
+ELIDED_PREFIX = "[Earlier result of "
+
+
+def estimate_tokens(message: AnyMessage) -> int:
+    """
+    Cheap token estimate for a message, tool call arguments included.
+
+    :param message: Any chat message
+    :return: Estimated number of tokens
+    """
+    size = len(str(message.content))
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        size += len(tool_call["name"]) + len(str(tool_call["args"]))
+    return size // CHARS_PER_TOKEN + 1
+
+
+class ContextWindow:
+    """
+    Keeps GeminiAssistant.message_history within a token budget.
+
+    The history is split into exchanges, each starting at a HumanMessage, so an AI message with tool calls
+    always stays together with its ToolMessages. The system prompt and the last `keep_exchanges` exchanges
+    are never touched, so keep_exchanges must be at least 1. Older tool results are replaced by short
+    references first; if that is not enough the oldest exchanges are folded into a summary appended to the
+    system prompt.
+    """
+
+    def __init__(self, token_budget: int = 30000, keep_exchanges: int = 3, elided_chars: int = 200,
+                 max_summary_lines: int = 30):
+        self.token_budget = token_budget
+        self.keep_exchanges = keep_exchanges
+        self.elided_chars = elided_chars
+        self.max_summary_lines = max_summary_lines
+
+    def compact(self, history: List[AnyMessage]) -> List[AnyMessage]:
+        """
+        Shrink the history so it fits the token budget.
+
+        :param history: Full message history, system prompt first
+        :return: New, compacted history
+        """
+        if not history or not isinstance(history[0], SystemMessage):
+            return history
+
+        base_prompt, _, summary = history[0].content.partition(SUMMARY_HEADER)
+        summary_lines = summary.splitlines() if summary else []
+        exchanges = self._split_exchanges(history[1:])
+
+        old, recent = exchanges[:-self.keep_exchanges], exchanges[-self.keep_exchanges:]
+        old = [self._elide_tool_results(exchange) for exchange in old]
+
+        def total():
+            size = len(base_prompt) + sum(len(line) for line in summary_lines)
+            return size // CHARS_PER_TOKEN + sum(estimate_tokens(m) for e in old + recent for m in e)
+
+        while old and total() > self.token_budget:
+            summary_lines.append(self._summarize(old.pop(0)))
+        summary_lines = summary_lines[-self.max_summary_lines:]
+
+        system = base_prompt
+        if summary_lines:
+            system += SUMMARY_HEADER + "\n".join(summary_lines)
+        return [SystemMessage(content=system)] + [m for e in old + recent for m in e]
+
+    def elide_old(self, history: List[AnyMessage]) -> List[AnyMessage]:
+        """
+        Shorten the tool results of all but the last `keep_exchanges` exchanges, whatever the budget.
+        Used for snapshots, where old payloads cost disk and load time but rarely matter again.
+
+        :param history: Full message history, system prompt first
+        :return: New history
+        """
+        if not history or not isinstance(history[0], SystemMessage):
+            return history
+        exchanges = self._split_exchanges(history[1:])
+        old, recent = exchanges[:-self.keep_exchanges], exchanges[-self.keep_exchanges:]
+        return history[:1] + [m for e in old for m in self._elide_tool_results(e)] + [m for e in recent for m in e]
+
+    @staticmethod
+    def _split_exchanges(messages: List[AnyMessage]) -> List[List[AnyMessage]]:
+        exchanges = []
+        for message in messages:
+            if isinstance(message, HumanMessage) or not exchanges:
+                exchanges.append([])
+            exchanges[-1].append(message)
+        return exchanges
+
+    def _elide_tool_results(self, exchange: List[AnyMessage]) -> List[AnyMessage]:
+        tool_names = {
+            tool_call["id"]: tool_call["name"]
+            for message in exchange if isinstance(message, AIMessage)
+            for tool_call in message.tool_calls
+        }
+        result = []
+        for message in exchange:
+            content = str(message.content)
+            if isinstance(message, ToolMessage) and len(content) > self.elided_chars \
+                    and not content.startswith(ELIDED_PREFIX):
+                name = tool_names.get(message.tool_call_id, "a tool")
+                message = ToolMessage(
+                    content=f"{ELIDED_PREFIX}{name} elided ({len(content)} chars), starts with: "
+                            f"{content[:self.elided_chars]}... Call the tool again if this data is needed.]",
+                    tool_call_id=message.tool_call_id
+                )
+            result.append(message)
+        return result
+
+    @staticmethod
+    def _summarize(exchange: List[AnyMessage]) -> str:
+        question = str(exchange[0].content) if isinstance(exchange[0], HumanMessage) else ""
+        tools = [tc["name"] for m in exchange if isinstance(m, AIMessage) for tc in m.tool_calls]
+        answers = [m for m in exchange if isinstance(m, AIMessage) and not m.tool_calls]
+        answer = (helpers.get_clean_message(answers[-1]) or "") if answers else ""
+
+        line = f"- User asked: {question[:200]}"
+        if tools:
+            line += f" | Tools used: {', '.join(dict.fromkeys(tools))}"
+        if answer:
+            line += f" | Answer: {answer[:200]}"
+        return " ".join(line.split())
@@ -1,15 +1,17 @@
 from typing import Optional
 
-import requests
-import streamlit as st
 from langchain_core.tools import tool
 from pydantic import EmailStr
 
+from utils import crm_client as crm
+from utils import filters as flt
+from utils import name_index
+from utils import tool_output as out
 from utils.schemas import CustomerBase
 
 
-@tool(name_or_callable="get_all_customers")
-def get_all_customers():
+@tool(name_or_callable="get_all_customers", response_format="content_and_artifact")
+def get_all_customers(page: int = 1, page_size: int = 10):
     """
     Retrieves a comprehensive list of all registered customers.
 
@@ -17,23 +19,23 @@ def get_all_customers():
     - Use this when the user asks to 'show all', 'list', 'fetch', or 'get data' for **customers** or **clients**.
     - Also use this if the user asks for a 'roster', 'directory', or 'names' of the entire customer base.
 
+    Paging:
+    - Returns one page of `page_size` customers (default 10). Ask user if he wants more (next 10).
+    - For "next 10" call this again with `page` + 1. Do not ask for bigger pages to get everything at once.
+
     Return:
-    - DO not return all the customers at once. Give only 10 customers in tabular format and ask user if he wants
-    more (next 10). If you already have all customers in context fetch the next customers from there and do not
-    call this function again.
-    - Only return this fields in this same order in tabular format :- cust_id, firstname, lastname, email, created_by
-    - Use emojis wherever you see fit for displaying data inside table
+    - The page is shown to the user as a table automatically. Do not re-type it, only write a short summary.
     """
-    res = requests.get(
-        "http://127.0.0.1:8000/customers/",
-        headers=st.session_state.headers
-    )
-    data = res.json()
-    return f"This is the data for all customers - {data}. Display this in a tabular format and do not miss any " \
-           f"columns."
+    data = crm.get_client().get_page("/customers/", page, page_size)
+    if "rows" not in data:
+        return f"Fetching customers failed with this response - {data}. Explain the user what went wrong.", None
+    table = out.encode_rows("get_all_customers", data["rows"], out.CUSTOMER_COLUMNS)
+    artifact = out.table_artifact(f"Customers - page {page}", data["rows"], out.CUSTOMER_COLUMNS, page=page)
+    return f"This is page {page} of all customers, tab separated with a header line -\n{table}\n" \
+           f"More pages available: {'yes' if data['has_more'] else 'no'}. {out.SHOWN_TABLE}", artifact
 
 
-@tool(name_or_callable="search_customers")
+@tool(name_or_callable="search_customers", response_format="content_and_artifact")
 def search_customers(
         customer_id: Optional[int] = None,
         first_name: Optional[str] = None,
@@ -53,9 +55,8 @@ def search_customers(
     **Supported Filters:**
     - Look for `first_name`, `last_name`, `email`, `phone_number`,`created_by` or `customer_id` in the user's request.
 
-    **Return Value:** - Returns a list of matching customers with their `customer_id`. - **Usage:** Use this tool
-    FIRST to find a `customer_id` when the user only gives you a name (e.g., "John") but you need the ID for other
-    actions like creating tickets.
+    **Return Value:** - Returns a list of matching customers with their `customer_id`. - If you only need the
+    `customer_id` of a name (e.g., "Create a ticket for John"), use `resolve_customer` instead.
     """
     payload = {}
     if first_name:
@@ -72,23 +73,43 @@ def search_customers(
         payload["created_by"] = created_by
 
     if customer_id:
-        res = requests.get(
-            f"http://127.0.0.1:8000/customers/{customer_id}",
-            headers=st.session_state.headers
-        )
-        data = res.json()
-        return f"The data for customer with id = {customer_id} is {data}. Display this customer in a nice format " \
-               f"with all details visible  and assign color and emojis for any field you feel " \
-               f"appropriate. Do not display this in tabular format "
-
-    res = requests.get(
-        "http://127.0.0.1:8000/customers/",
-        headers=st.session_state.headers
-    )
-    data = res.json()
+        data = crm.get_client().get_json(f"/customers/{customer_id}")
+        record = out.encode_record("search_customers", data)
+        artifact = out.record_artifact(f"Customer #{customer_id}", data)
+        return f"The data for customer with id = {customer_id} is -\n{record}\n{out.SHOWN_RECORD}", artifact
+
+    try:
+        data = flt.search_records("customers", payload, flt.CUSTOMER_FILTERS)
+    except Exception as e:
+        return f"During Searching of customer, this following error has occurred - {e}." \
+               "Explain the user what went wrong and give them correction in really short summary", None
+    return out.search_result("search_customers", "Customers", payload, data, out.CUSTOMER_COLUMNS)
+
 
-    return f"The data for all customers is {data}. Fetch entries that match the requirements given by user - " \
-           f"{payload} and display it in tabular format without missing any columns."
+@tool(name_or_callable="resolve_customer")
+def resolve_customer(name: str, limit: int = 5):
+    """
+    Resolves a customer name to `customer_id` candidates with a match score (1.0 = exact name).
+
+    **Triggers:**
+    - Use this FIRST whenever you need a `customer_id` and the user only gave a name, e.g. "Create a ticket for
+      John Smith", "Show tickets of Maria". Accepts full names, first or last names, prefixes and misspellings.
+
+    **Behavior:**
+    - If exactly one candidate has a clearly higher score, use its id.
+    - If several candidates are equally good, list them briefly and ask the user which one they mean.
+    """
+    try:
+        index = name_index.get_index("customers")
+    except Exception as e:
+        return f"Resolving the customer name failed with this error - {e}. Use `search_customers` instead."
+    candidates = index.lookup(name, limit)
+    if not candidates:
+        return f"No customer matches the name '{name}'. Ask the user to check the name."
+    table = out.encode_rows("resolve_customer", candidates)
+    more = index.count(name) - len(candidates)
+    note = f"\n{more} more customers have exactly this name, ask for their email or company." if more > 0 else ""
+    return f"Best customer candidates for '{name}', tab separated with a header line -\n{table}{note}"
 
 
 @tool(name_or_callable="create_new_customer", args_schema=CustomerBase)  # type: ignore
@@ -134,12 +155,12 @@ def create_new_customer(
         email=email,
         phone=phone
     )
-    res = requests.post(
-        "http://127.0.0.1:8000/customers/",
-        json=customer.model_dump(),
-        headers=st.session_state.headers
-    )
-    return f"Successfully created a customer with id {res.json()['customer_id']}"
+    client = crm.get_client()
+    res = client.post("/customers/", json=customer.model_dump())
+    data = res.json()
+    client.invalidate("customers", data, data['customer_id'])
+    name_index.upsert("customers", data)
+    return f"Successfully created a customer with id {data['customer_id']}"
 
 
 @tool(name_or_callable="update_customer_data")
@@ -180,13 +201,12 @@ def update_customer_data(
         return "You did not mention any fields to be updated. Need at least 1 field"
 
     try:
-        res = requests.put(
-            f"http://127.0.0.1:8000/customers/{customer_id}",
-            json=payload,
-            headers=st.session_state.headers
-        )
+        client = crm.get_client()
+        res = client.put(f"/customers/{customer_id}", json=payload)
         res.raise_for_status()
         if res.status_code == 200:
+            client.invalidate("customers", res.json(), customer_id)
+            name_index.upsert("customers", res.json())
             return f"Successfully updated customer with id {res.json()['customer_id']}"
     except Exception as e:
         return f"The update process has failed and gave this error - {e} Explain the user what went wrong and how to " \
@@ -1,37 +1,39 @@
 from typing import Optional
 
-import requests
-import streamlit as st
 from langchain_core.tools import tool
 
+from utils import crm_client as crm
+from utils import filters as flt
+from utils import name_index
+from utils import tool_output as out
 from utils import schemas as sch
 from utils.schemas import EmployeeBase
 
 
-@tool(name_or_callable="get_all_employees")
-def get_all_employees():
+@tool(name_or_callable="get_all_employees", response_format="content_and_artifact")
+def get_all_employees(page: int = 1, page_size: int = 10):
     """
     Retrieves a comprehensive list of all employees from the organization's database. Use this tool when the user
     asks to 'show all employees', 'list everyone', 'get employee data', or specifically requests names, roles, IDs,
     or contact details of the staff. It provides a full roster of current personnel.
 
+    Paging:
+    - Returns one page of `page_size` employees (default 10). Ask user if he wants more (next 10).
+    - For "next 10" call this again with `page` + 1. Do not ask for bigger pages to get everything at once.
+
     Return:
-    - DO not return all the employees at once. Give only 10 employees in tabular format and ask user if he wants
-    more (next 10). If you already have all employees in context fetch the next employees from there and do not
-    call this function again.
-    - Only return this fields in this same order in tabular format :- emp_id, firstname, lastname, access_level
-    - Use emojis wherever you see fit for displaying data inside table
+    - The page is shown to the user as a table automatically. Do not re-type it, only write a short summary.
     """
-    res = requests.get(
-        "http://127.0.0.1:8000/employees/",
-        headers=st.session_state.headers
-    )
-    data = res.json()
-    return f"This is the data for all employees - {data}. Display this in a tabular format and do not miss any " \
-           f"columns."
+    data = crm.get_client().get_page("/employees/", page, page_size)
+    if "rows" not in data:
+        return f"Fetching employees failed with this response - {data}. Explain the user what went wrong.", None
+    table = out.encode_rows("get_all_employees", data["rows"], out.EMPLOYEE_COLUMNS)
+    artifact = out.table_artifact(f"Employees - page {page}", data["rows"], out.EMPLOYEE_COLUMNS, page=page)
+    return f"This is page {page} of all employees, tab separated with a header line -\n{table}\n" \
+           f"More pages available: {'yes' if data['has_more'] else 'no'}. {out.SHOWN_TABLE}", artifact
 
 
-@tool(name_or_callable="search_employee")
+@tool(name_or_callable="search_employee", response_format="content_and_artifact")
 def search_employee(
         employee_id: Optional[int] = None,
         first_name: Optional[str] = None,
@@ -60,27 +62,42 @@ def search_employee(
             payload["access_level"] = access_level
 
         if employee_id:
-            res = requests.get(
-                f"http://127.0.0.1:8000/employees/{employee_id}",
-                headers=st.session_state.headers
-            )
-            data = res.json()
-            return f"The data for employee with id = {employee_id} is {data}. Display this employee in a nice format with " \
-                   f"all details visible  and assign color and emojis for any field you feel " \
-                   f"appropriate. Do not display this in tabular format "
-
-        res = requests.get(
-            "http://127.0.0.1:8000/employees/",
-            headers=st.session_state.headers
-        )
-        data = res.json()
-        return f"The data for all employees is {data}. Fetch entries that match the requirements given by user - " \
-               f"{payload} and display it in tabular format without missing any columns. Remember, STRICTLY " \
-               f"TABULAR FORMAT"
+            data = crm.get_client().get_json(f"/employees/{employee_id}")
+            record = out.encode_record("search_employee", data)
+            artifact = out.record_artifact(f"Employee #{employee_id}", data)
+            return f"The data for employee with id = {employee_id} is -\n{record}\n{out.SHOWN_RECORD}", artifact
+
+        data = flt.search_records("employees", payload, flt.EMPLOYEE_FILTERS)
+        return out.search_result("search_employee", "Employees", payload, data, out.EMPLOYEE_COLUMNS)
     except Exception as e:
         return f"During Searching of employee, this following error has occurred - {e}." \
-               "Explain the user what went wrong and give them correction in really short summary"
-    pass
+               "Explain the user what went wrong and give them correction in really short summary", None
+
+
+@tool(name_or_callable="resolve_employee")
+def resolve_employee(name: str, limit: int = 5):
+    """
+    Resolves an employee name to `employee_id` candidates with a match score (1.0 = exact name).
+
+    **Triggers:**
+    - Use this FIRST whenever you need an `employee_id` and the user only gave a name, e.g. "Assign ticket 5 to
+      Priya", "Analyze Omar's performance". Accepts full names, first or last names, prefixes and misspellings.
+
+    **Behavior:**
+    - If exactly one candidate has a clearly higher score, use its id.
+    - If several candidates are equally good, list them briefly and ask the user which one they mean.
+    """
+    try:
+        index = name_index.get_index("employees")
+    except Exception as e:
+        return f"Resolving the employee name failed with this error - {e}. Use `search_employee` instead."
+    candidates = index.lookup(name, limit)
+    if not candidates:
+        return f"No employee matches the name '{name}'. Ask the user to check the name."
+    table = out.encode_rows("resolve_employee", candidates)
+    more = index.count(name) - len(candidates)
+    note = f"\n{more} more employees have exactly this name, ask for their email." if more > 0 else ""
+    return f"Best employee candidates for '{name}', tab separated with a header line -\n{table}{note}"
 
 
 @tool(name_or_callable="create_new_employee",args_schema=EmployeeBase)  # type: ignore
@@ -125,13 +142,12 @@ def create_new_employee(
         )
 
         payload = e.model_dump(mode='json',exclude_none=True)
-        res = requests.post(
-            "http://127.0.0.1:8000/employees/",
-            json=payload,
-            headers=st.session_state.headers
-        )
-        print(res.json())
-        return f"Successfully created an employee with id {res.json().get('employee_id')}"
+        client = crm.get_client()
+        res = client.post("/employees/", json=payload)
+        data = res.json()
+        client.invalidate("employees", data, data.get('employee_id'))
+        name_index.upsert("employees", data)
+        return f"Successfully created an employee with id {data.get('employee_id')}"
     except Exception as e:
         return f"During Creation of employee, this following error has occurred - {e}." \
                "Explain the user what went wrong and give them correction in really short summary"
@@ -169,13 +185,12 @@ def update_employee(
         return "You did not mention any fields to be updated. Need at least 1 field"
 
     try:
-        res = requests.put(
-            f"http://127.0.0.1:8000/employees/{employee_id}",
-            json=payload,
-            headers=st.session_state.headers
-        )
+        client = crm.get_client()
+        res = client.put(f"/employees/{employee_id}", json=payload)
         res.raise_for_status()
         if res.status_code == 200:
+            client.invalidate("employees", res.json(), employee_id)
+            name_index.upsert("employees", res.json())
             return f"Successfully updated employee with id {res.json().get('employee_id')}"
     except Exception as e:
         return f"The update process has failed and gave this error - {e} Explain the user what went wrong and how to " \
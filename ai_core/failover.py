@@ -0,0 +1,195 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import streamlit as st
+from langchain_core.messages import AIMessage, ToolMessage
+
+from ai_core import models
+from utils import helpers, tracing
+
+# Models tried in order when the selected one fails, skipping the selected one. Entries whose secret is not
+# configured are left out.
+FALLBACK_CHAIN = (
+    ("Gemini", "gemini-2.5-flash-lite", "gemini_secret_4"),
+    ("Gemini", "gemini-2.5-flash", "gemini_secret_4"),
+    ("Groq", "llama-3.3-70b-versatile", "groq_secret"),
+)
+
+# Hedging: once a call has run longer than the p95 latency of its model over the last LATENCY_WINDOW calls
+# (at least HEDGE_MIN_SECONDS), the first fallback is asked as well and the first answer wins.
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_SECONDS = 2.0
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="crm-llm")
+_lock = threading.Lock()
+_latencies = {}
+_stats = {"failovers": 0, "hedges": 0, "hedge_wins": 0}
+
+
+def hedging_enabled() -> bool:
+    """
+    Hedging is off unless turned on with the `CRM_LLM_HEDGE=1` env variable or the `llm_hedging` secret.
+    Hedged calls cost tokens for both answers.
+    """
+    value = os.environ.get("CRM_LLM_HEDGE")
+    if value is None:
+        try:
+            value = st.secrets.get("llm_hedging", False)
+        except Exception:
+            value = False
+    return str(value).strip().lower() in {"1", "true", "yes", "on"}
+
+
+def observe(model: str, seconds: float):
+    """
+    Record the latency of a successful call.
+    """
+    with _lock:
+        _latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def hedge_after(model: str):
+    """
+    :return: Seconds after which a call of the model is hedged, None until enough calls were seen
+    """
+    with _lock:
+        samples = sorted(_latencies.get(model, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(samples[int(len(samples) * 0.95) - 1], HEDGE_MIN_SECONDS)
+
+
+def portable(messages: list) -> list:
+    """
+    Provider neutral copy of a history, for a model of another provider than the one that wrote it. AI
+    messages keep their text and tool calls only; provider specific content parts and metadata (e.g. Gemini
+    thought signatures) are dropped.
+    """
+    result = []
+    for message in messages:
+        if isinstance(message, AIMessage):
+            message = AIMessage(content=helpers.get_clean_message(message) or "", tool_calls=message.tool_calls)
+        elif isinstance(message, ToolMessage) and not isinstance(message.content, str):
+            message = ToolMessage(content=str(message.content), tool_call_id=message.tool_call_id)
+        result.append(message)
+    return result
+
+
+def chain(primary, tools: list) -> list:
+    """
+    The selected model followed by the configured fallbacks.
+
+    :param primary: Bound model of the session
+    :param tools: Tools to bind to the fallbacks, the same as the primary's
+    :return: [(provider, get_model)] in order; get_model builds (or reuses) the bound model when called
+    """
+    key = models.key_of(primary)
+    provider = key[0] if key else None
+    result = [(provider, lambda: primary)]
+    for fallback_provider, model, secret in FALLBACK_CHAIN:
+        if key and (fallback_provider, model) == key[:2]:
+            continue
+        try:
+            api_key = st.secrets.get(secret)
+        except Exception:
+            api_key = None
+        if api_key:
+            result.append((fallback_provider, lambda p=fallback_provider, m=model, k=api_key:
+                           models.get_model(p, m, k, tools)))
+    return result
+
+
+def _submit(fn, *args):
+    # Calls on the pool keep the trace of the turn.
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def invoke(primary, messages: list, tools: list, call, model_name) -> AIMessage:
+    """
+    Invoke the selected model, falling over to the next model of the chain when a call fails, and hedging a
+    slow first call if enabled.
+
+    :param primary: Bound model of the session
+    :param messages: History to send
+    :param tools: Tools bound to the models
+    :param call: call(bound, messages, last) makes one scheduled and traced call; `last` is True for the
+        final model of the chain, the only one worth waiting for a rate limit
+    :param model_name: model_name(bound) -> name used for the latency statistics
+    :return: The first answer
+    """
+    candidates = chain(primary, tools)
+    primary_provider = candidates[0][0]
+    error = None
+    i = 0
+    while i < len(candidates):
+        provider, get = candidates[i]
+        try:
+            bound = get()
+            history = messages if provider == primary_provider else portable(messages)
+            last = i == len(candidates) - 1
+            delay = hedge_after(model_name(bound)) if i == 0 and not last and hedging_enabled() else None
+            if delay is None:
+                return _timed(call, bound, history, last, model_name)
+
+            first = _submit(_timed, call, bound, history, False, model_name)
+            done, _ = wait([first], timeout=delay)
+            if done:
+                return first.result()
+
+            # The first call is slow, ask the next model too and take whichever answers first.
+            i += 1
+            provider, get = candidates[i]
+            try:
+                hedge_bound = get()
+            except Exception:
+                return first.result()
+            hedge = _submit(_timed, call, hedge_bound,
+                            messages if provider == primary_provider else portable(messages),
+                            i == len(candidates) - 1, model_name)
+            with _lock:
+                _stats["hedges"] += 1
+            pending = {first, hedge}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            with _lock:
+                                _stats["hedge_wins"] += 1
+                        return future.result()
+                    error = future.exception()
+        except Exception as e:
+            error = e
+        i += 1
+        if i < len(candidates):
+            with _lock:
+                _stats["failovers"] += 1
+            span = tracing.current_span()
+            if span is not None:
+                span.set(failover=True)
+    raise error
+
+
+def _timed(call, bound, messages, last, model_name):
+    start = time.perf_counter()
+    result = call(bound, messages, last)
+    observe(model_name(bound), time.perf_counter() - start)
+    return result
+
+
+def failover_stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def _metrics() -> list:
+    return [("crm_llm_failover_total", "counter", "LLM calls failed over to the next model, and hedged calls.",
+             [({"event": event}, count) for event, count in failover_stats().items()])]
+
+
+tracing.add_metrics(_metrics)
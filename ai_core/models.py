@@ -0,0 +1,117 @@
+import atexit
+import hashlib
+import inspect
+import threading
+import weakref
+from collections import OrderedDict
+
+from ai_core import providers
+
+# Bound models kept alive in the process. Every session using the same provider, model and key shares one.
+# An evicted model is only dropped from the cache; sessions still holding it keep using it, and its HTTP
+# clients go away with the last reference.
+MAX_MODELS = 16
+
+_lock = threading.Lock()
+_models: "OrderedDict[tuple, object]" = OrderedDict()
+_keys = {}
+_stats = {"builds": 0, "hits": 0, "evictions": 0}
+
+
+def fingerprint(api_key: str) -> str:
+    """
+    Keys are never stored in the cache, only a short hash of them.
+    """
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+def get_model(provider: str, model: str, api_key: str, tools: list):
+    """
+    Return the shared chat model for provider/model/key with the tools bound, building it on first use.
+
+    :param provider: Provider registered in ai_core.providers
+    :param model: Any tool supported model of the provider
+    :param api_key: Secret key
+    :param tools: Tools to bind. They are the same for every session, so they are not part of the cache key.
+    :return: Bound chat model
+    """
+    key = (provider, model, fingerprint(api_key))
+    with _lock:
+        if key in _models:
+            _models.move_to_end(key)
+            _stats["hits"] += 1
+            return _models[key]
+
+    # Built outside the lock so a slow build does not hold up sessions using other models.
+    bound = providers.build(provider, model, api_key).bind_tools(tools)
+
+    evicted = []
+    with _lock:
+        if key in _models:
+            # Another session built the same model meanwhile, keep theirs.
+            evicted.append(bound)
+            bound = _models[key]
+        else:
+            _models[key] = bound
+            _keys[id(bound)] = key
+            # key_of keeps answering for as long as any session holds the model, evicted or not.
+            weakref.finalize(bound, _forget, id(bound))
+            _stats["builds"] += 1
+            while len(_models) > MAX_MODELS:
+                _models.popitem(last=False)
+                _stats["evictions"] += 1
+    # Only a duplicate that lost the build race is closed, nobody else has seen it.
+    for stale in evicted:
+        close_model(stale)
+    return bound
+
+
+def _forget(bound_id: int):
+    with _lock:
+        _keys.pop(bound_id, None)
+
+
+def key_of(bound):
+    """
+    :param bound: Model returned by get_model
+    :return: (provider, model, key fingerprint) it was built for, None for a model built elsewhere
+    """
+    with _lock:
+        return _keys.get(id(bound))
+
+
+def close_model(bound):
+    """
+    Best effort close of the HTTP clients held by a (bound) chat model.
+    """
+    chat_model = getattr(bound, "bound", bound)
+    for attr in ("client", "async_client"):
+        client = getattr(chat_model, attr, None)
+        # Groq keeps the resource object on the model, the HTTP client is one level below.
+        for candidate in (client, getattr(client, "_client", None)):
+            close = getattr(candidate, "close", None)
+            if not callable(close) or inspect.iscoroutinefunction(close):
+                continue
+            try:
+                close()
+            except Exception:
+                pass
+
+
+def model_stats() -> dict:
+    with _lock:
+        return {**_stats, "size": len(_models)}
+
+
+def shutdown():
+    """
+    Close every cached model. Called at interpreter exit.
+    """
+    with _lock:
+        models = list(_models.values())
+        _models.clear()
+    for bound in models:
+        close_model(bound)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,137 @@
+import importlib
+import json
+import os
+import threading
+
+import streamlit as st
+
+
+class Provider:
+    """
+    A chat model SDK the assistant can use. The SDK is imported the first time the provider is needed,
+    so the chat page does not pay for SDKs nobody selected.
+    """
+
+    def __init__(self, name: str, module: str, class_name: str, prices: dict, **options):
+        """
+        :param name: Name shown in the Configure popover
+        :param module: Module of the langchain integration
+        :param class_name: Chat model class in that module
+        :param prices: Tool supported models offered for the provider, default first, mapped to their
+            (input, output) price in USD per million tokens
+        :param options: Extra keyword arguments for the chat model
+        """
+        self.name = name
+        self.module = module
+        self.class_name = class_name
+        self.models = list(prices)
+        self.prices = prices
+        self.options = options
+        self.chat_class = None
+
+
+_lock = threading.Lock()
+_providers = {}
+
+
+def register(provider: Provider):
+    with _lock:
+        _providers[provider.name] = provider
+
+
+# List prices of the providers, check them when adding a model.
+register(Provider("Gemini", "langchain_google_genai", "ChatGoogleGenerativeAI", {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-3-flash": (0.50, 3.00),
+}))
+register(Provider("Groq", "langchain_groq", "ChatGroq", {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "qwen/qwen3-32b": (0.29, 0.59),
+}, temperature=0.7))
+
+
+def names() -> list:
+    return list(_providers)
+
+
+def model_options() -> dict:
+    """
+    :return: {provider: [models]}
+    """
+    return {name: provider.models for name, provider in _providers.items()}
+
+
+def price(model: str):
+    """
+    :param model: Model name as reported by the chat model
+    :return: (input, output) USD per million tokens, None for a model without a price
+    """
+    for provider in _providers.values():
+        if model in provider.prices:
+            return provider.prices[model]
+    # Gemini reports its models as "models/<name>".
+    if model and model.startswith("models/"):
+        return price(model[len("models/"):])
+    return None
+
+
+def configured_limits() -> dict:
+    """
+    Rate limits of the deployment's API keys, from the `CRM_LLM_LIMITS` env variable (JSON) or the
+    `llm_limits` secret, e.g. {"gemini-2.5-flash": [10, 250000]}. They depend on the tier of the keys, so
+    nothing is assumed when neither is set.
+
+    :return: Model -> (requests per minute, tokens per minute); either may be null to leave it unlimited
+    """
+    value = os.environ.get("CRM_LLM_LIMITS")
+    if value is None:
+        try:
+            value = st.secrets.get("llm_limits", {})
+        except Exception:
+            value = {}
+    try:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return {str(model): (rpm, tpm) for model, (rpm, tpm) in dict(value).items()}
+    except (TypeError, ValueError):
+        return {}
+
+
+def limits(model: str):
+    """
+    :param model: Model name as reported by the chat model
+    :return: (requests per minute, tokens per minute) per API key, None if the model is not throttled. Such
+        models are only held back after the provider answers with a rate limit error.
+    """
+    configured = configured_limits()
+    if model and model.startswith("models/"):
+        # Gemini reports its models as "models/<name>".
+        model = model[len("models/"):]
+    return configured.get(model)
+
+
+def load(name: str):
+    """
+    Import the SDK of a provider, once.
+
+    :param name: Registered provider name
+    :return: Chat model class
+    """
+    provider = _providers.get(name)
+    if provider is None:
+        raise ValueError(f"Unsupported provider {name}")
+    with _lock:
+        if provider.chat_class is None:
+            provider.chat_class = getattr(importlib.import_module(provider.module), provider.class_name)
+    return provider.chat_class
+
+
+def build(name: str, model: str, api_key: str):
+    """
+    :param name: Registered provider name
+    :param model: Any tool supported model of the provider
+    :param api_key: Secret key
+    :return: Chat model, not bound to any tools
+    """
+    return load(name)(model=model, api_key=api_key, **_providers[name].options)
@@ -0,0 +1,156 @@
+import os
+import re
+import threading
+
+import streamlit as st
+
+from utils import schemas as sch
+from utils import tracing
+
+# Words that may appear in a request without changing its meaning.
+_VERBS = "show|list|get|fetch|display|find|give|view"
+_FILLER = rf"(?:please\s+)?(?:(?:can|could)\s+you\s+)?(?:{_VERBS}|open)?\s*(?:me\s+)?"
+# "open" is a ticket status as well, so it is not accepted as a verb in front of a filtered search.
+_SEARCH_FILLER = rf"(?:please\s+)?(?:(?:can|could)\s+you\s+)?(?:{_VERBS})?\s*(?:me\s+)?"
+_ID = r"\s*(?:#|no\.?\s*|number\s*|id\s*:?\s*)?(\d+)"
+
+# Vocabulary of the ticket enums, plus the few synonyms the tool docstrings already define.
+TICKET_WORDS = {
+    **{m.value.lower(): ("status", m.value) for m in sch.TicketStatus},
+    **{m.value.lower(): ("priority", m.value) for m in sch.TicketPriority},
+    **{m.value.lower(): ("ticket_type", m.value) for m in sch.TicketType},
+    "urgent": ("priority", sch.TicketPriority.CRITICAL.value),
+    "done": ("status", sch.TicketStatus.CLOSED.value),
+    "resolved": ("status", sch.TicketStatus.CLOSED.value),
+    "bugs": ("ticket_type", sch.TicketType.BUG.value),
+    "feature": ("ticket_type", sch.TicketType.FEATURE.value),
+    "features": ("ticket_type", sch.TicketType.FEATURE.value),
+    "inquiries": ("ticket_type", sch.TicketType.INQUIRY.value),
+}
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "fallbacks": 0}
+
+
+def is_enabled() -> bool:
+    """
+    The router is on unless turned off with the `CRM_FAST_PATH=0` env variable or the `fast_path_router` secret.
+    """
+    value = os.environ.get("CRM_FAST_PATH")
+    if value is None:
+        try:
+            value = st.secrets.get("fast_path_router", True)
+        except Exception:
+            value = True
+    return str(value).strip().lower() not in {"0", "false", "no", "off"}
+
+
+def record(outcome: str):
+    """
+    :param outcome: "hits", "misses" or "fallbacks" (routed, but the result still needed the LLM)
+    """
+    with _lock:
+        _stats[outcome] += 1
+
+
+def router_stats() -> dict:
+    with _lock:
+        total = _stats["hits"] + _stats["misses"] + _stats["fallbacks"]
+        return {**_stats, "hit_rate": _stats["hits"] / total if total else 0.0}
+
+
+def _metrics() -> list:
+    return [("crm_router_turns_total", "counter", "Turns answered by the fast path, sent to the LLM, or routed "
+             "and still needing it.", [({"outcome": outcome}, count) for outcome, count in router_stats().items()
+                                       if outcome != "hit_rate"])]
+
+
+tracing.add_metrics(_metrics)
+
+
+def _ticket_filters(words: str, current_emp):
+    """
+    Map the adjectives in front of "tickets" to search_ticket filters. Unknown words make the parse fail.
+    """
+    args = {}
+    words = " ".join(words.lower().split())
+    # Multi word values ("in progress", "feature request") first.
+    for phrase in sorted(TICKET_WORDS, key=len, reverse=True):
+        if " " in phrase and re.search(rf"\b{phrase}\b", words):
+            field, value = TICKET_WORDS[phrase]
+            args[field] = value
+            words = re.sub(rf"\b{phrase}\b", " ", words)
+
+    for word in words.split():
+        if word in {"all", "the", "priority"}:
+            continue
+        if word in {"my", "mine"} and current_emp is not None:
+            args["assignee_id"] = current_emp
+            continue
+        if word not in TICKET_WORDS:
+            return None
+        field, value = TICKET_WORDS[word]
+        if field in args and args[field] != value:
+            return None
+        args[field] = value
+    return args
+
+
+class IntentRouter:
+    """
+    Pattern rules for trivial requests that map straight onto a single tool call, so they can be answered
+    without calling the LLM. Anything the rules are not sure about returns None and goes to the LLM.
+    """
+
+    def __init__(self, current_emp=None):
+        self.current_emp = current_emp
+        self.rules = [
+            (rf"^{_FILLER}ticket{_ID}$", lambda m: ("search_ticket", {"ticket_id": int(m[1])})),
+            (rf"^{_FILLER}customer{_ID}$", lambda m: ("search_customers", {"customer_id": int(m[1])})),
+            (rf"^{_FILLER}(?:employee|agent){_ID}$", lambda m: ("search_employee", {"employee_id": int(m[1])})),
+            (rf"^{_SEARCH_FILLER}(?:all\s+)?tickets$", lambda m: ("get_all_tickets", {})),
+            (rf"^{_SEARCH_FILLER}(?:all\s+)?(?:customers|clients)$", lambda m: ("get_all_customers", {})),
+            (rf"^{_SEARCH_FILLER}(?:all\s+)?(?:employees|agents)$", lambda m: ("get_all_employees", {})),
+            (r"^(?:please\s+)?(?:mark|set)\s+ticket" + _ID + r"\s+(?:as|to)\s+([a-z ]+)$", self._status_update),
+            (r"^(?:please\s+)?(close|resolve)\s+ticket" + _ID + "$",
+             lambda m: ("update_ticket", {"ticket_id": int(m[2]), "status": sch.TicketStatus.CLOSED.value})),
+            (r"^(?:please\s+)?reopen\s+ticket" + _ID + "$",
+             lambda m: ("update_ticket", {"ticket_id": int(m[1]), "status": sch.TicketStatus.OPEN.value})),
+            (rf"^{_SEARCH_FILLER}((?:[a-z]+\s+){{0,4}}?)tickets?"
+             r"(?:\s+(?:for|of)\s+customer" + _ID + r")?"
+             r"(?:\s+assigned\s+to\s+(?:employee|agent)" + _ID + r")?$", self._ticket_search),
+        ]
+        self.rules = [(re.compile(pattern, re.IGNORECASE), build) for pattern, build in self.rules]
+
+    def route(self, prompt: str):
+        """
+        :param prompt: The user Query
+        :return: (tool name, args) if a rule matches with certainty, else None
+        """
+        text = " ".join(prompt.strip().rstrip("?.!").split())
+        for pattern, build in self.rules:
+            match = pattern.match(text)
+            if match:
+                routed = build(match)
+                if routed:
+                    return routed
+        return None
+
+    @staticmethod
+    def _status_update(match):
+        field, value = TICKET_WORDS.get(match[2].strip().lower(), (None, None))
+        if field != "status":
+            return None
+        return "update_ticket", {"ticket_id": int(match[1]), "status": value}
+
+    def _ticket_search(self, match):
+        args = _ticket_filters(match[1] or "", self.current_emp)
+        if args is None:
+            return None
+        if match[2]:
+            args["customer_id"] = int(match[2])
+        if match[3]:
+            args["assignee_id"] = int(match[3])
+        if not args:
+            return None
+        return "search_ticket", args
@@ -0,0 +1,280 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from ai_core import providers
+from utils import tracing
+
+# Longest a call waits for its turn. Calls that would wait longer fail right away with Overloaded.
+MAX_WAIT = 45
+
+# Calls waiting per lane before new ones are turned away.
+MAX_QUEUE = 200
+
+# Output tokens charged up front per call; the bucket is corrected with the real usage afterwards.
+OUTPUT_ESTIMATE = 512
+
+# Retries of a call answered with a rate limit error, after waiting the delay the provider asked for.
+MAX_RETRIES = 2
+
+# Delay used when a rate limit error does not say how long to wait.
+DEFAULT_RETRY_AFTER = 10
+
+_RETRY_IN = re.compile(r"(?:retry|try again)\D{0,20}?(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+class Overloaded(Exception):
+    """
+    The model is at its rate limit and the call would have to wait longer than MAX_WAIT.
+    """
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"{model} is at its rate limit, please try again in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+class Lane:
+    """
+    Rate limits of one (provider, model, key fingerprint): a requests per minute and a tokens per minute
+    token bucket, both refilled continuously. A limit of None is not enforced.
+
+    Waiting calls are grouped by session and served round robin, one call per session in turn, so a
+    session firing many calls cannot starve the others.
+    """
+
+    def __init__(self, key: tuple, rpm: int = None, tpm: int = None):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm or 0)
+        self.tokens = float(tpm or 0)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+        self.sessions = OrderedDict()
+        self.stats = {"granted": 0, "rejected": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    def _refill(self, now: float):
+        elapsed, self.updated = now - self.updated, now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def _delay(self, cost: int, now: float, ahead: int = 0) -> float:
+        """
+        Seconds until a call of `cost` tokens fits, behind `ahead` other calls.
+        """
+        delay = self.paused_until - now
+        if self.rpm:
+            delay = max(delay, (ahead + 1 - self.requests) * 60 / self.rpm)
+        if self.tpm:
+            delay = max(delay, ((ahead + 1) * min(cost, self.tpm) - self.tokens) * 60 / self.tpm)
+        return delay
+
+    def depth(self) -> int:
+        return sum(len(waiters) for waiters in self.sessions.values())
+
+    def acquire(self, session, cost: int, max_wait: float = MAX_WAIT) -> float:
+        """
+        Wait for the turn of the session and for room in both buckets, then take it.
+
+        :return: Seconds waited
+        :raise Overloaded: The queue is full or the wait would exceed max_wait
+        """
+        start = time.monotonic()
+        deadline = start + max_wait
+        waiter = object()
+        granted = False
+        with self.cond:
+            self._refill(start)
+            depth = self.depth()
+            estimate = self._delay(cost, start, depth)
+            if depth >= MAX_QUEUE or estimate > max_wait:
+                self.stats["rejected"] += 1
+                raise Overloaded(self.key[1], max(estimate, 1))
+
+            self.sessions.setdefault(session, deque()).append(waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    head = self.sessions[next(iter(self.sessions))]
+                    delay = self._delay(cost, now) if head[0] is waiter else deadline - now
+                    if head[0] is waiter and delay <= 0:
+                        if self.rpm:
+                            self.requests -= 1
+                        if self.tpm:
+                            self.tokens -= cost
+                        granted = True
+                        break
+                    if (head[0] is waiter and now + delay > deadline) or now >= deadline:
+                        self.stats["rejected"] += 1
+                        raise Overloaded(self.key[1], max(delay, 1))
+                    self.cond.wait(min(delay, deadline - now))
+            finally:
+                waiters = self.sessions[session]
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.sessions[session]
+                elif granted:
+                    # Round robin, the session goes behind the others.
+                    self.sessions.move_to_end(session)
+                self.cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.stats["granted"] += 1
+            self.stats["wait_seconds"] += waited
+            return waited
+
+    def settle(self, estimated: int, used: int):
+        """
+        Correct the token bucket once the real usage of a call is known. It may go below zero, later calls
+        then wait for the refill.
+        """
+        if not used or not self.tpm:
+            return
+        with self.cond:
+            self.tokens -= used - estimated
+
+    def penalize(self, retry_after: float):
+        """
+        The provider answered with a rate limit error: hold every call of the lane for retry_after seconds.
+        """
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            if self.rpm:
+                self.requests = min(self.requests, 0.0)
+            self.stats["rate_limited"] += 1
+            self.cond.notify_all()
+
+
+_lock = threading.Lock()
+_lanes = {}
+
+
+def lane(key: tuple) -> Lane:
+    """
+    :param key: (provider, model, key fingerprint), see models.key_of
+    """
+    with _lock:
+        if key not in _lanes:
+            rpm, tpm = providers.limits(key[1]) or (None, None)
+            _lanes[key] = Lane(key, rpm, tpm)
+        return _lanes[key]
+
+
+def retry_after(error: Exception):
+    """
+    :return: Seconds the provider asked to wait if the error is a rate limit error, else None
+    """
+    if isinstance(error, Overloaded):
+        return None
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None) or \
+        getattr(error, "code", None)
+    text = str(error)
+    if status != 429 and "RESOURCE_EXHAUSTED" not in text and "rate limit" not in text.lower():
+        return None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass
+    match = _RETRY_IN.search(text)
+    return float(match.group(1)) if match else DEFAULT_RETRY_AFTER
+
+
+class Slot:
+    def __init__(self, lane_: Lane, cost: int):
+        self.lane = lane_
+        self.cost = cost
+
+    def settle(self, usage_metadata: dict):
+        self.lane.settle(self.cost, (usage_metadata or {}).get("total_tokens", 0))
+
+
+@contextmanager
+def slot(key: tuple, session, cost: int):
+    """
+    Hold a slot of the lane for one LLM call. A rate limit error raised inside pauses the lane.
+
+    :param key: (provider, model, key fingerprint)
+    :param session: Anything identifying the calling session
+    :param cost: Estimated input tokens of the call
+    :return: Slot, call settle() with the usage_metadata of the response
+    """
+    lane_ = lane(key)
+    cost += OUTPUT_ESTIMATE
+    with tracing.span(key[1], "queue", depth=lane_.depth()) as span:
+        span.set(wait_ms=round(lane_.acquire(session, cost) * 1000, 3))
+    try:
+        yield Slot(lane_, cost)
+    except Exception as e:
+        delay = retry_after(e)
+        if delay is not None:
+            lane_.penalize(delay)
+        raise
+
+
+def call(key: tuple, session, cost: int, fn, retries: int = MAX_RETRIES):
+    """
+    Run fn() in a slot of the lane. A rate limit error is retried after the delay the provider asked for,
+    up to `retries` times, as long as that delay is below MAX_WAIT.
+
+    :param fn: Makes the call and returns an AI message
+    :param retries: 0 when there is a fallback model to try instead of waiting
+    :return: Result of fn
+    """
+    for attempt in range(retries + 1):
+        try:
+            with slot(key, session, cost) as s:
+                result = fn()
+                s.settle(getattr(result, "usage_metadata", None))
+                return result
+        except Exception as e:
+            delay = retry_after(e)
+            if delay is None or attempt == retries:
+                raise
+            if delay > MAX_WAIT:
+                raise Overloaded(key[1], delay) from e
+
+
+def stats() -> dict:
+    """
+    :return: {(provider, model, key fingerprint): queue depth, bucket levels and counters}
+    """
+    with _lock:
+        lanes = list(_lanes.values())
+    result = {}
+    for lane_ in lanes:
+        with lane_.cond:
+            lane_._refill(time.monotonic())
+            result[lane_.key] = {"depth": lane_.depth(), "rpm": lane_.rpm, "tpm": lane_.tpm,
+                                 "requests_left": lane_.requests if lane_.rpm else None,
+                                 "tokens_left": lane_.tokens if lane_.tpm else None, **lane_.stats}
+    return result
+
+
+def _metrics() -> list:
+    depth, left, counters, wait = [], [], [], []
+    for (provider, model, fp), s in stats().items():
+        labels = {"provider": provider, "model": model, "key": fp}
+        depth.append((labels, s["depth"]))
+        for bucket in ("requests", "tokens"):
+            if s[f"{bucket}_left"] is not None:
+                left.append(({**labels, "bucket": bucket}, s[f"{bucket}_left"]))
+        wait.append((labels, s["wait_seconds"]))
+        for outcome in ("granted", "rejected", "rate_limited"):
+            counters.append(({**labels, "outcome": outcome}, s[outcome]))
+    return [
+        ("crm_llm_queue_depth", "gauge", "LLM calls waiting for their turn.", depth),
+        ("crm_llm_bucket_level", "gauge", "Requests and tokens left in the rate limit buckets.", left),
+        ("crm_llm_calls_total", "counter", "LLM calls granted, turned away and answered with a 429.", counters),
+        ("crm_llm_wait_seconds_total", "counter", "Time granted LLM calls spent waiting.", wait),
+    ]
+
+
+tracing.add_metrics(_metrics)
@@ -1,11 +1,72 @@
 from typing import Optional
 
-import requests
-import streamlit as st
+import pandas as pd
 from langchain_core.tools import tool
 
+from utils import crm_client as crm
 from utils import schemas as sch
 
+RECENT_TICKETS = 5
+MAX_BAR_LENGTH = 20
+
+
+def _count_by(df: pd.DataFrame, column: str, enum) -> dict:
+    """
+    Count tickets per enum member. Every member is present in the result, even with a count of 0.
+
+    :param df: Tickets
+    :param column: Column holding the enum value
+    :param enum: Enum listing the allowed values
+    :return: value -> count, in enum order
+    """
+    values = [member.value for member in enum]
+    if column not in df:
+        return dict.fromkeys(values, 0)
+    counts = df[column].value_counts().reindex(values, fill_value=0)
+    return {value: int(count) for value, count in counts.items()}
+
+
+def _bar(count: int, total: int) -> str:
+    if not total:
+        return ""
+    return "■" * max(round(count / total * MAX_BAR_LENGTH), 1 if count else 0)
+
+
+def summarize_tickets(tickets: list) -> dict:
+    """
+    Compute the statistics behind the analysis dashboard.
+
+    :param tickets: Tickets as returned by the API
+    :return: Totals, status/priority/type breakdowns and the most recent tickets
+    """
+    df = pd.DataFrame(tickets)
+    total = len(df)
+
+    status = _count_by(df, "status", sch.TicketStatus)
+    priority = _count_by(df, "priority", sch.TicketPriority)
+    ticket_type = _count_by(df, "ticket_type", sch.TicketType)
+
+    resolved = status[sch.TicketStatus.CLOSED.value]
+    active = total - resolved
+
+    recent = []
+    if total:
+        order_by = "created_at" if "created_at" in df else "ticket_id" if "ticket_id" in df else None
+        latest = df.sort_values(order_by, ascending=False) if order_by else df.iloc[::-1]
+        columns = [c for c in ("ticket_id", "title", "status") if c in df]
+        recent = latest.head(RECENT_TICKETS)[columns].to_dict("records")
+
+    return {
+        "total_tickets": total,
+        "active": active,
+        "resolved": resolved,
+        "resolution_rate": f"{resolved / total:.0%}" if total else "n/a",
+        "priority": priority,
+        "status": {value: f"{_bar(count, total)} ({count})" for value, count in status.items()},
+        "ticket_type": ticket_type,
+        "recent_tickets": recent,
+    }
+
 
 @tool(name_or_callable="show_individual_analysis")
 def show_individual_analysis(
@@ -13,21 +74,22 @@ def show_individual_analysis(
         customer_id: Optional[int] = None,
 ):
     """
-    Fetches raw ticket data to generate a detailed performance or activity analysis for a specific Employee OR Customer.
+    Gives precomputed ticket statistics to present a detailed performance or activity analysis for a specific
+    Employee OR Customer.
 
     **WHEN TO USE:**
     - Use this when the user asks to "analyze", "review performance", "check stats", or "show history" for a person.
     - REQUIRED: You must have either an `employee_id` OR a `customer_id`.
 
     **CRITICAL INSTRUCTION FOR THE AI (HOW TO DISPLAY DATA):**
-    Do NOT output the raw JSON. You must calculate and present a "Statistical Dashboard" using the returned data.
+    All numbers are already calculated. Do NOT recount or change them, only present them as a "Statistical Dashboard".
     If the api says that no employee/customer can be found with the key they provided, inform the user that no
     employee/customer with that id exist.
 
     **Layout & Visuals to Generate:**
     1.  **📊 Executive Summary**:
         - Total Tickets Found.
-        - Active vs. Resolved Count.
+        - Active vs. Resolved Count and the resolution rate.
 
     2.  **🚨 Priority Breakdown** (Use emojis):
         - 🔴 Critical/High: [Count]
@@ -35,13 +97,13 @@ def show_individual_analysis(
         - 🔵 Low: [Count]
 
     3.  **🥧 Status Distribution**:
-        - Create a text-based bar chart (e.g., "Open: ■■■■■ (5)", "Closed: ■■ (2)").
+        - Show the given text-based bars as they are (e.g., "Open: ■■■■■ (5)").
 
     4.  **🏷️ Ticket Type Analysis**:
         - Count of Bugs vs. Features vs. Inquiries.
 
     5.  **📋 Recent Activity Log**:
-        - List the last 3-5 tickets with their ID, Title, and current Status formatted as a clean table.
+        - List the recent tickets with their ID, Title, and current Status formatted as a clean table.
 
     **Example Output Style:**
     "### 👤 Analysis for Employee #42
@@ -52,10 +114,8 @@ def show_individual_analysis(
         "customer_id": customer_id,
         "employee_id": employee_id
     }
-    res = requests.get(
-        "http://127.0.0.1:8000/tickets/search",
-        headers=st.session_state.headers,
-        params=q_params
-    )
-    data = res.json()
-    return f"This is the data for the requested query - {data}"
+    data = crm.get_client().get_json("/tickets/search", params=q_params)
+    if not isinstance(data, list):
+        return f"The API could not give tickets for the requested query - {data}"
+
+    return f"These are the precomputed statistics for the requested query - {summarize_tickets(data)}"
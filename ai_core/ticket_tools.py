@@ -1,40 +1,48 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-import requests
-import streamlit as st
 from langchain_core.tools import tool
 
+from utils import crm_client as crm
+from utils import filters as flt
+from utils import text_index
+from utils import tool_output as out
 from utils import schemas as sch
 from utils.schemas import TicketBase
 
+# Concurrent PUTs of one bulk update, and the most tickets one bulk update may touch.
+BULK_WORKERS = 8
+BULK_MAX_TICKETS = 500
 
-@tool(name_or_callable="get_all_tickets")
-def get_all_tickets():
+
+@tool(name_or_callable="get_all_tickets", response_format="content_and_artifact")
+def get_all_tickets(page: int = 1, page_size: int = 10):
     """
     Retrieves a comprehensive list of all support tickets in the system.
 
     Triggers:
     - Use this when the user asks to 'show all', 'list', 'fetch', or 'get data' for **tickets**, **issues**, **cases**, or **requests**.
     - Also use this if the user asks for a 'log', 'queue', or 'history' of all support items.
-    - Also use this if user asks for a count of total no of tickets based on any criteria such as assigned, ticket type, or status.
+
+    Paging:
+    - Returns one page of `page_size` tickets (default 10). Ask user if he wants more (next 10).
+    - For "next 10" call this again with `page` + 1. Do not ask for bigger pages to get everything at once.
 
     Return:
-    - DO not return all the ticket at once. Give only 10 tickets in tabular format and ask user if he wants
-    more (next 10). If you already have all ticekts in context fetch the next tickets from there and do not
-    call this function again.
-    - Only return this fields in this same order in tabular format :- ticket_id , ticket_title, status, priority, type
-    - Use emojis wherever you see fit for displaying data inside table
-    - When user asks for 'count' or 'total' tickets based on any criteria, only return the count in sentence and not all tickets.
+    - The page is shown to the user as a table automatically. Do not re-type it, only write a short summary.
+    - For a 'count' or 'total' of tickets use `search_ticket` instead, it reports the number of matches.
     """
-    res = requests.get(
-        "http://127.0.0.1:8000/tickets/",
-        headers=st.session_state.headers
-    )
-    data = res.json()
-    return f"This is the data for all tickets - {data}."
+    data = crm.get_client().get_page("/tickets/", page, page_size)
+    if "rows" not in data:
+        return f"Fetching tickets failed with this response - {data}. Explain the user what went wrong.", None
+    table = out.encode_rows("get_all_tickets", data["rows"], out.TICKET_COLUMNS)
+    artifact = out.table_artifact(f"Tickets - page {page}", data["rows"], out.TICKET_COLUMNS, page=page)
+    return f"This is page {page} of all tickets, tab separated with a header line -\n{table}\n" \
+           f"More pages available: {'yes' if data['has_more'] else 'no'}. {out.SHOWN_TABLE}", artifact
 
 
-@tool(name_or_callable="search_ticket")
+@tool(name_or_callable="search_ticket", response_format="content_and_artifact")
 def search_ticket(
         ticket_id: Optional[int] = None,
         title: Optional[str] = None,
@@ -53,13 +61,17 @@ def search_ticket(
 
     **Triggers:** - Call this when the user asks to 'find', 'search', 'get', or 'show' tickets matching specific
     attributes. - Examples: "Find ticket #105", "Show me high priority tickets", "List tickets for customer 12",
-    "What is the status of the 'Login Error' ticket?".
+    "What is the status of the 'Login Error' ticket?". - Also use this when the user asks for a 'count' or 'total' of
+    tickets based on any criteria; reply with the number of matches in a sentence and not all tickets.
 
     **Behavior & Parameters:** - **Single Ticket:** If the user provides a specific ID (e.g., "Ticket 10"),
     pass strictly `ticket_id`. - **Filtering:** Use other parameters (`status`, `priority`, `customer_id`,
     etc.) to filter the list. - **Status/Priority/Type:** Map adjectives like "urgent" -> `priority='Critical'`,
     "open" -> `status='Open'`, "bug" -> `ticket_type='Bug'`.
 
+    **Keywords:** - `title` and `description` are keyword searches ranked by relevance, e.g. "login error" ->
+    `title='login error'`. Use `quantity` for how many of the best matches to return (default 20).
+
     **Exclusion:** - Do NOT use this if the user asks for "all tickets" or a "full list" without any conditions (use
     `get_all_tickets` instead).
     """
@@ -83,31 +95,42 @@ def search_ticket(
             payload["status"] = status
         if created_by_id:
             payload["created_by_id"] = created_by_id
-        if quantity:
-            payload["quantity"] = quantity
 
         if ticket_id:
-            res = requests.get(
-                f"http://127.0.0.1:8000/tickets/{ticket_id}",
-                headers=st.session_state.headers
-            )
-            data = res.json()
-            return f"The data for ticket with id = {ticket_id} is {data}. Display this ticket in a nice format with " \
-                   f"all details visible  and assign color and emojis for type or status pr any other field you feel " \
-                   f"appropriate. Do not display this in tabular format "
-
-        res = requests.get(
-            "http://127.0.0.1:8000/tickets/",
-            headers=st.session_state.headers
-        )
-        data = res.json()
-        return f"The data for all tickets is {data}. Fetch entries that match the requirements given by user - " \
-               f"{payload} and display it in tabular format without missing any columns. Remember, STRICTLY " \
-               f"TABULAR FORMAT"
+            data = crm.get_client().get_json(f"/tickets/{ticket_id}")
+            record = out.encode_record("search_ticket", data)
+            artifact = out.record_artifact(f"Ticket #{ticket_id}", data)
+            return f"The data for ticket with id = {ticket_id} is -\n{record}\n{out.SHOWN_RECORD}", artifact
+
+        if title or description:
+            found = _keyword_search(title, description, payload, quantity)
+            if found is not None:
+                total, hits = found
+                table = out.encode_rows("search_ticket", hits, out.TICKET_COLUMNS + ["score"])
+                artifact = out.table_artifact(out.describe("Tickets", payload), hits, out.TICKET_COLUMNS,
+                                              total=total)
+                return f"{total} tickets in total match {payload}. These are the top {len(hits)}, best match " \
+                       f"first, tab separated with a header line -\n{table}\n{out.SHOWN_TABLE}", artifact
+
+        data = flt.search_records("tickets", payload, flt.TICKET_FILTERS, quantity)
+        return out.search_result("search_ticket", "Tickets", payload, data, out.TICKET_COLUMNS)
     except Exception as e:
         return f"During Searching of ticket, this following error has occurred - {e}." \
-               "Explain the user what went wrong and give them correction in really short summary"
-    pass
+               "Explain the user what went wrong and give them correction in really short summary", None
+
+
+def _keyword_search(title, description, filters: dict, quantity):
+    """
+    Ranked search of the local text index. None if the index is unavailable, the caller then falls back to
+    filtering on the API.
+
+    :return: (total number of matches, best hits)
+    """
+    try:
+        index = text_index.get_index()
+    except Exception:
+        return None
+    return index.search(f"{title or ''} {description or ''}", filters, quantity or text_index.DEFAULT_TOP_K)
 
 
 @tool(name_or_callable="create_new_ticket", args_schema=TicketBase)  # type: ignore
@@ -130,7 +153,7 @@ def create_new_ticket(
     concise, professional description based on the title or context
 
     **Critical Prerequisite (Chaining):** - This function **REQUIRES** a numeric `customer_id`. - If the user
-    provided a **name** (e.g., "Create a ticket for John"), you **MUST** first call `search_customers` to find John's
+    provided a **name** (e.g., "Create a ticket for John"), you **MUST** first call `resolve_customer` to find John's
     `customer_id`. - **DO NOT** hallucinate or guess the ID. If you don't have it, find it first.
     """
     try:
@@ -152,13 +175,12 @@ def create_new_ticket(
         )
 
         payload = t.model_dump(mode='json', exclude_none=True)
-        res = requests.post(
-            "http://127.0.0.1:8000/tickets/",
-            json=payload,
-            headers=st.session_state.headers
-        )
-        print(res.json())
-        return f"Successfully created a ticket with id {res.json()['ticket_id']}"
+        client = crm.get_client()
+        res = client.post("/tickets/", json=payload)
+        data = res.json()
+        client.invalidate("tickets", data, data['ticket_id'])
+        text_index.upsert(data)
+        return f"Successfully created a ticket with id {data['ticket_id']}"
     except Exception as e:
         return f"During Creation of ticket, this following error has occurred - {e}." \
                "Explain the user what went wrong and give them correction in really short summary"
@@ -194,14 +216,114 @@ def update_ticket(
         return "You did not mention any fields to be updated. Need at least 1 field"
 
     try:
-        res = requests.put(
-            f"http://127.0.0.1:8000/tickets/{ticket_id}",
-            json=payload,
-            headers=st.session_state.headers
-        )
+        client = crm.get_client()
+        res = client.put(f"/tickets/{ticket_id}", json=payload)
         res.raise_for_status()
         if res.status_code == 200:
+            client.invalidate("tickets", res.json(), ticket_id)
+            text_index.upsert(res.json())
             return f"Successfully updated ticket with id {res.json()['ticket_id']}"
     except Exception as e:
         return f"The update process has failed and gave this error - {e} Explain the user what went wrong and how to " \
                f"correct it "
+
+
+@tool(name_or_callable="bulk_update_tickets", response_format="content_and_artifact")
+def bulk_update_tickets(
+        customer_id: Optional[int] = None,
+        assignee_id: Optional[int] = None,
+        created_by_id: Optional[int] = None,
+        ticket_type: Optional[sch.TicketType] = None,
+        priority: Optional[sch.TicketPriority] = None,
+        status: Optional[sch.TicketStatus] = None,
+        title: Optional[str] = None,
+        set_assignee_id: Optional[int] = None,
+        set_ticket_type: Optional[sch.TicketType] = None,
+        set_priority: Optional[sch.TicketPriority] = None,
+        set_status: Optional[sch.TicketStatus] = None,
+        dry_run: bool = True
+):
+    """
+    Applies one change to every ticket matching a filter, in a single call.
+
+    **Triggers:**
+    - Use this instead of repeated `update_ticket` calls whenever the user wants to change more than one ticket,
+      e.g. "close all open tickets for customer 12" -> `customer_id=12, status='Open', set_status='Closed'`,
+      "reassign all of agent 7's tickets to agent 9" -> `assignee_id=7, set_assignee_id=9`.
+
+    **Parameters:**
+    - Filters (`customer_id`, `assignee_id`, `created_by_id`, `ticket_type`, `priority`, `status`, `title`) select
+      the tickets, like in `search_ticket`. At least one filter is required.
+    - `set_*` fields are the change applied to every selected ticket. At least one is required.
+
+    **Dry run (IMPORTANT):**
+    - First call with `dry_run=True` (the default). It changes nothing and reports how many tickets would change.
+    - Tell the user that number and only call again with `dry_run=False` after they confirm.
+    """
+    filters = {
+        "customer_id": customer_id, "assignee_id": assignee_id, "created_by_id": created_by_id,
+        "ticket_type": ticket_type, "priority": priority, "status": status, "title": title,
+    }
+    patch = {
+        "assignee_id": set_assignee_id, "ticket_type": set_ticket_type, "priority": set_priority,
+        "status": set_status,
+    }
+    filters = flt.build_query(filters, flt.TICKET_FILTERS)
+    patch = flt.build_query(patch, flt.TICKET_FILTERS)
+    if not filters:
+        return "Error! Bulk updates need at least one filter. Ask the user which tickets to change.", None
+    if not patch:
+        return "Error! You did not mention any fields to be changed. Need at least 1 `set_` field.", None
+
+    try:
+        tickets = flt.search_records("tickets", filters, flt.TICKET_FILTERS)
+    except Exception as e:
+        return f"Selecting the tickets failed with this error - {e}. Explain the user what went wrong.", None
+
+    if not tickets:
+        return f"No tickets match {filters}. Nothing to change.", None
+    pending = [t for t in tickets
+               if any(str(t.get(f)).casefold() != str(v).casefold() for f, v in patch.items())]
+    unchanged = len(tickets) - len(pending)
+    if len(pending) > BULK_MAX_TICKETS:
+        return f"{len(pending)} tickets match {filters}, more than the limit of {BULK_MAX_TICKETS} for one bulk " \
+               f"update. Ask the user to narrow the filters.", None
+
+    if dry_run:
+        preview = out.encode_rows("bulk_update_tickets", pending[:20], out.TICKET_COLUMNS)
+        artifact = out.table_artifact(f"Preview - {len(pending)} tickets would change", pending, out.TICKET_COLUMNS)
+        return f"DRY RUN, nothing was changed. {len(pending)} tickets match {filters} and would get {patch} " \
+               f"({unchanged} already have it). First of them -\n{preview}\nAsk the user to confirm, then call " \
+               f"again with dry_run=False.", artifact
+
+    client = crm.get_client()
+    headers = client.session_headers()
+
+    def put(ticket: dict) -> dict:
+        ticket_id = ticket["ticket_id"]
+        try:
+            res = client.put(f"/tickets/{ticket_id}", json=patch, headers=headers)
+            res.raise_for_status()
+            return {"ticket_id": ticket_id, "result": "updated", "error": None, "record": res.json()}
+        except Exception as e:
+            return {"ticket_id": ticket_id, "result": "failed", "error": str(e)[:200], "record": None}
+
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix="crm-bulk") as pool:
+        # Each PUT runs in its own copy of the context, so its trace span joins this tool call.
+        report = list(pool.map(lambda t: contextvars.copy_context().run(put, t), pending))
+    client.invalidate("tickets")
+    for r in report:
+        record = r.pop("record")
+        if r["result"] == "updated":
+            client.invalidate("tickets", record, r["ticket_id"])
+            text_index.upsert(record)
+
+    failed = [r for r in report if r["result"] == "failed"]
+    updated = len(report) - len(failed)
+    artifact = out.table_artifact(f"Bulk update - {updated} updated, {len(failed)} failed", report,
+                                  ["ticket_id", "result", "error"])
+    text = f"Applied {patch} to tickets matching {filters}: {updated} updated, {len(failed)} failed, " \
+           f"{unchanged} already up to date."
+    if failed:
+        text += f" Failures -\n{out.encode_rows('bulk_update_tickets', failed)}\nExplain the failures to the user."
+    return text, artifact
@@ -0,0 +1,182 @@
+"""
+End-to-end agent turns without a provider or a live CRM. A stub CRM (stub_crm.py) runs in a child process,
+the chat model is replaced by a scripted one (scripted_llm.py), and GeminiAssistant is driven through the
+scenarios below. Reports per scenario:
+  - p50 / p95 turn latency
+  - HTTP calls to the CRM per turn
+  - LLM calls and prompt bytes per turn
+  - peak Python memory of a turn (tracemalloc, measured in a separate pass)
+
+    python benchmarks/agent_turns.py --tickets 100000 --repeat 20
+    python benchmarks/agent_turns.py --no-fast-path --stream --json results.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from scripted_llm import ScriptedChatModel, call, say  # noqa: E402
+
+# (name, prompt, responses the model gives when the turn reaches it)
+SCENARIOS = [
+    ("ticket by id", "Show ticket 42", [
+        call(("search_ticket", {"ticket_id": 42})),
+        say("Here is ticket #42."),
+    ]),
+    ("filtered search", "How many open high priority bugs do we have?", [
+        call(("search_ticket", {"status": "Open", "priority": "High", "ticket_type": "Bug"})),
+        say("There are several open high priority bugs."),
+    ]),
+    ("keyword search", "Find open tickets about login failures", [
+        call(("search_ticket", {"title": "login fails", "status": "Open", "quantity": 10})),
+        say("These open tickets mention login failures."),
+    ]),
+    ("first page", "List all tickets", [
+        call(("get_all_tickets", {})),
+        say("Here are the first 10 tickets."),
+    ]),
+    ("next page", "Next 10", [
+        call(("get_all_tickets", {"page": 2})),
+        say("Here are the next 10 tickets."),
+    ]),
+    ("chained lookup", "Show the tickets of customer John Smith", [
+        call(("resolve_customer", {"name": "John Smith"})),
+        call(("search_ticket", {"customer_id": 1, "quantity": 20})),
+        say("These are John Smith's tickets."),
+    ]),
+    ("parallel analysis", "Compare employees 2 and 3", [
+        call(("show_individual_analysis", {"employee_id": 2}), ("show_individual_analysis", {"employee_id": 3})),
+        say("Employee 2 resolves more tickets than employee 3."),
+    ]),
+    ("status change", "Mark ticket 42 as closed", [
+        call(("update_ticket", {"ticket_id": 42, "status": "Closed"})),
+        say("Ticket #42 is now closed."),
+    ]),
+    ("create ticket", "Create a ticket for customer 5 titled Export is broken", [
+        call(("create_new_ticket", {"title": "Export is broken", "customer_id": 5,
+                                    "description": "Export of reports fails."})),
+        say("Created the ticket."),
+    ]),
+]
+
+
+def start_stub(args) -> (subprocess.Popen, str):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "stub_crm.py"), "--port", "0",
+         "--tickets", str(args.tickets), "--customers", str(args.customers), "--employees", str(args.employees)],
+        stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line:
+        raise SystemExit("Stub CRM did not start")
+    return proc, line.strip().rsplit(" ", 1)[-1]
+
+
+def make_agent(base_url: str, fast_path: bool):
+    os.environ["CRM_BASE_URL"] = base_url
+    os.environ["CRM_FAST_PATH"] = "1" if fast_path else "0"
+    import streamlit as st
+    from ai_core.agent import GeminiAssistant
+
+    # Bare mode warns about the missing script context on every session_state access.
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    st.session_state["current_emp"] = 1
+    st.session_state["current_emp_name"] = "Bench User"
+    st.session_state["access_level"] = "admin"
+    st.session_state["headers"] = {"Authorization": "Bearer stub-token"}
+    agent = GeminiAssistant()
+    agent.llm = ScriptedChatModel()
+    return agent
+
+
+def run_turn(agent, prompt: str, responses: list, base_url: str, stream: bool) -> dict:
+    agent.llm.play(responses)
+    requests.post(f"{base_url}/__reset")
+    start = time.perf_counter()
+    if stream:
+        for _ in agent.stream_message(prompt):
+            pass
+    else:
+        agent.send_message(prompt)
+    elapsed = time.perf_counter() - start
+    calls = requests.get(f"{base_url}/__stats").json()
+    return {"latency": elapsed, "http_calls": sum(calls.values()), "llm_calls": len(agent.llm.prompt_bytes),
+            "prompt_bytes": sum(agent.llm.prompt_bytes)}
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--employees", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10, help="Times every scenario is run")
+    parser.add_argument("--stream", action="store_true", help="Drive stream_message instead of send_message")
+    parser.add_argument("--no-fast-path", action="store_true", help="Send every turn to the (scripted) LLM")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    proc, base_url = start_stub(args)
+    try:
+        agent = make_agent(base_url, not args.no_fast_path)
+        results = {name: [] for name, _, _ in SCENARIOS}
+        for _ in range(args.repeat):
+            for name, prompt, responses in SCENARIOS:
+                results[name].append(run_turn(agent, prompt, responses, base_url, args.stream))
+
+        # Memory is measured in its own pass, tracemalloc slows everything down.
+        peaks = {}
+        tracemalloc.start()
+        for name, prompt, responses in SCENARIOS:
+            tracemalloc.reset_peak()
+            run_turn(agent, prompt, responses, base_url, args.stream)
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        proc.terminate()
+
+    summary = {}
+    print(f"{args.tickets} tickets, {args.repeat} runs per scenario, "
+          f"{'stream' if args.stream else 'send'}_message, fast path {'off' if args.no_fast_path else 'on'}\n")
+    print(f"{'scenario':<20}{'p50 ms':>9}{'p95 ms':>9}{'http/turn':>11}{'llm/turn':>10}"
+          f"{'prompt KB':>11}{'peak MB':>9}")
+    for name, runs in results.items():
+        latencies = [r["latency"] * 1000 for r in runs]
+        row = {
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": percentile(latencies, 95),
+            "http_calls_per_turn": statistics.mean(r["http_calls"] for r in runs),
+            "llm_calls_per_turn": statistics.mean(r["llm_calls"] for r in runs),
+            "prompt_bytes_per_turn": statistics.mean(r["prompt_bytes"] for r in runs),
+            "peak_bytes": peaks[name],
+        }
+        summary[name] = row
+        print(f"{name:<20}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['http_calls_per_turn']:>11.2f}"
+              f"{row['llm_calls_per_turn']:>10.2f}{row['prompt_bytes_per_turn'] / 1024:>11.1f}"
+              f"{row['peak_bytes'] / 2 ** 20:>9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "scenarios": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Cold start of the chat page: time to import ai_core.agent in a fresh interpreter, and the extra time the first
+use of each provider adds. Every sample runs in its own process so nothing is already in sys.modules.
+
+    python benchmarks/import_time.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import json, time, warnings
+warnings.filterwarnings("ignore")
+import streamlit as st
+# The agent module used to read these at import time.
+st.session_state["current_emp"] = 1
+st.session_state["access_level"] = "admin"
+
+t = time.perf_counter()
+import ai_core.agent
+result = {"import ai_core.agent": time.perf_counter() - t}
+
+try:
+    from ai_core import providers
+except ImportError:
+    providers = None
+if providers:
+    for name in providers.names():
+        t = time.perf_counter()
+        providers.load(name)
+        result[f"first use of {name}"] = time.perf_counter() - t
+print(json.dumps(result))
+"""
+
+
+def sample() -> dict:
+    proc = subprocess.run([sys.executable, "-c", SNIPPET], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode:
+        raise SystemExit(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [sample() for _ in range(args.runs)]
+    for step in runs[0]:
+        times = sorted(run[step] for run in runs)
+        print(f"{step:<28} median {statistics.median(times) * 1000:8.1f} ms   "
+              f"min {times[0] * 1000:8.1f} ms   max {times[-1] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
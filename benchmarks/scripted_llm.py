@@ -0,0 +1,64 @@
+"""
+Chat model that plays back predetermined responses instead of calling a provider, so agent turns can be
+benchmarked offline. It also records how much prompt the agent sent on every call.
+"""
+import json
+import uuid
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+def call(*calls) -> AIMessage:
+    """
+    A response asking for tool calls.
+
+    :param calls: (tool name, args) pairs, several of them make a parallel call
+    """
+    return AIMessage(content="", tool_calls=[
+        {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:8]}"} for name, args in calls
+    ])
+
+
+def say(text: str) -> AIMessage:
+    """
+    A final text response.
+    """
+    return AIMessage(content=text)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Returns the responses of `script` one per call, in order. Once the script runs out it answers with a
+    plain "Done." so a turn always ends.
+    """
+
+    script: List[AIMessage] = []
+    prompt_bytes: List[int] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def play(self, responses: list):
+        """
+        Load the responses for the next turn and clear the prompt measurements.
+        """
+        self.script = list(responses)
+        self.prompt_bytes = []
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        size = sum(len(json.dumps(m.content, default=str)) for m in messages)
+        self.prompt_bytes.append(size)
+        message = self.script.pop(0) if self.script else say("Done.")
+        message = message.model_copy(update={
+            "usage_metadata": {"input_tokens": size // 4, "output_tokens": len(str(message.content)) // 4 + 1,
+                               "total_tokens": size // 4 + len(str(message.content)) // 4 + 1},
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,292 @@
+"""
+In-memory stand-in for the CRM API, for benchmarks. Serves the routes the tools and chat helpers use,
+seeded with a deterministic data set of any size, and counts the requests it receives.
+
+    python benchmarks/stub_crm.py --tickets 100000 --customers 5000 --employees 200 --port 8100
+
+GET /__stats returns the request counters, POST /__reset clears them.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+STATUS = ["Open", "In Progress", "Closed"]
+PRIORITY = ["Critical", "High", "Medium", "Low"]
+TICKET_TYPE = ["Bug", "Feature Request", "Inquiry", "Billing", "Access"]
+ACCESS = ["admin", "agent"]
+
+SUBJECTS = ["Login", "Invoice", "Export", "Dashboard", "Password reset", "API", "Report", "Upload", "Search",
+            "Notification", "Billing address", "Mobile app", "SSO", "Permissions", "Webhook"]
+PROBLEMS = ["fails", "is slow", "shows wrong data", "times out", "returns error 500", "is missing",
+            "needs a new option", "cannot be saved", "is duplicated", "does not load"]
+FIRST = ["John", "Maria", "Wei", "Aisha", "Lucas", "Priya", "Omar", "Sofia", "Ivan", "Emma", "Kenji", "Fatima"]
+LAST = ["Smith", "Garcia", "Chen", "Khan", "Silva", "Patel", "Haddad", "Rossi", "Petrov", "Brown", "Sato", "Ali"]
+COMPANIES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Wonka", "Tyrell", "Soylent"]
+
+
+class Store:
+    """
+    Tickets are kept column-wise in arrays so a million of them fit in a few dozen MB. Text fields are derived
+    from the id, records written through the API are kept as dicts on top.
+    """
+
+    def __init__(self, tickets: int, customers: int, employees: int, seed: int = 7):
+        rnd = random.Random(seed)
+        self.customers = [self._customer(i, rnd, employees) for i in range(1, customers + 1)]
+        self.employees = [self._employee(i, rnd) for i in range(1, employees + 1)]
+        self.n_tickets = tickets
+        self.columns = {
+            "status": array("b", (rnd.randrange(3) for _ in range(tickets))),
+            "priority": array("b", (rnd.randrange(4) for _ in range(tickets))),
+            "ticket_type": array("b", (rnd.randrange(5) for _ in range(tickets))),
+            "customer_id": array("i", (rnd.randint(1, max(customers, 1)) for _ in range(tickets))),
+            "assignee_id": array("i", (rnd.randint(1, max(employees, 1)) for _ in range(tickets))),
+            "created_by_id": array("i", (rnd.randint(1, max(employees, 1)) for _ in range(tickets))),
+        }
+        self.written = {}
+        self.chats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _customer(i, rnd, employees):
+        first, last = rnd.choice(FIRST), rnd.choice(LAST)
+        return {"customer_id": i, "first_name": first, "last_name": last, "company": rnd.choice(COMPANIES),
+                "email": f"{first}.{last}{i}@example.com".lower(), "phone": f"+1555{i:07d}",
+                "created_by": rnd.randint(1, max(employees, 1))}
+
+    @staticmethod
+    def _employee(i, rnd):
+        first, last = rnd.choice(FIRST), rnd.choice(LAST)
+        return {"employee_id": i, "first_name": first, "last_name": last,
+                "email": f"{first}.{last}{i}@crm.example.com".lower(), "phone": f"+1444{i:07d}",
+                "access_level": ACCESS[0] if i % 10 == 1 else ACCESS[1]}
+
+    def ticket(self, ticket_id: int):
+        if ticket_id in self.written:
+            return self.written[ticket_id]
+        if not 1 <= ticket_id <= self.n_tickets:
+            return None
+        i, c = ticket_id - 1, self.columns
+        subject, problem = SUBJECTS[ticket_id % len(SUBJECTS)], PROBLEMS[(ticket_id // 7) % len(PROBLEMS)]
+        return {"ticket_id": ticket_id, "title": f"{subject} {problem}",
+                "description": f"Customer reports that {subject.lower()} {problem} since the last release.",
+                "status": STATUS[c["status"][i]], "priority": PRIORITY[c["priority"][i]],
+                "ticket_type": TICKET_TYPE[c["ticket_type"][i]], "customer_id": c["customer_id"][i],
+                "assignee_id": c["assignee_id"][i], "created_by_id": c["created_by_id"][i]}
+
+    def ticket_ids(self):
+        yield from range(1, self.n_tickets + 1)
+        yield from (tid for tid in self.written if tid > self.n_tickets)
+
+    def search_tickets(self, query: dict, limit: int = None) -> list:
+        if "employee_id" in query:
+            query["assignee_id"] = query.pop("employee_id")
+        coded = {"status": STATUS, "priority": PRIORITY, "ticket_type": TICKET_TYPE}
+        checks = []
+        for field, value in query.items():
+            if field in coded:
+                values = [v.lower() for v in coded[field]]
+                if value.lower() not in values:
+                    return []
+                checks.append((field, values.index(value.lower())))
+            elif field in self.columns:
+                checks.append((field, int(value)))
+        text = {f: v.lower() for f, v in query.items() if f in ("title", "description")}
+
+        found = []
+        for tid in self.ticket_ids():
+            if tid in self.written or tid > self.n_tickets:
+                record = self.ticket(tid)
+                if any(str(record.get(f)).lower() != str(coded[f][v] if f in coded else v).lower()
+                       for f, v in checks):
+                    continue
+            elif any(self.columns[f][tid - 1] != v for f, v in checks):
+                continue
+            else:
+                record = None
+            if text:
+                record = record or self.ticket(tid)
+                if any(v not in str(record.get(f, "")).lower() for f, v in text.items()):
+                    continue
+            found.append(record or self.ticket(tid))
+            if limit and len(found) >= limit:
+                break
+        return found
+
+
+class StubCRM(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store: Store):
+        super().__init__(address, Handler)
+        self.store = store
+        self.calls = {}
+        self.calls_lock = threading.Lock()
+
+    def count(self, method: str, path: str):
+        route = method + " " + re.sub(r"/\d+", "/{id}", path)
+        with self.calls_lock:
+            self.calls[route] = self.calls.get(route, 0) + 1
+
+
+def _match(record: dict, query: dict) -> bool:
+    return all(str(value).lower() in str(record.get(field, "")).lower() for field, value in query.items())
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this keep-alive requests wait on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw or b"{}")
+        return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+    def _request(self, method: str):
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if not path.startswith("/__"):
+            self.server.count(method, path)
+        try:
+            status, body = self.route(method, path, query)
+        except Exception as e:
+            status, body = 500, {"detail": repr(e)}
+        self._send(status, body)
+
+    def do_GET(self):
+        self._request("GET")
+
+    def do_POST(self):
+        self._request("POST")
+
+    def do_PUT(self):
+        self._request("PUT")
+
+    def route(self, method: str, path: str, query: dict):
+        store = self.server.store
+        parts = path.strip("/").split("/")
+        skip, limit = int(query.pop("skip", 0)), query.pop("limit", None)
+        limit = int(limit) if limit else None
+
+        if path == "/__stats":
+            with self.server.calls_lock:
+                return 200, dict(self.server.calls)
+        if path == "/__reset":
+            with self.server.calls_lock:
+                self.server.calls.clear()
+            return 200, {}
+        if path == "/login" and method == "POST":
+            return 200, {"access_token": "stub-token", "emp_id": 1, "emp_name": "Bench User", "access": "admin"}
+
+        if parts[0] == "chat":
+            return self.chat(method, parts[1:], query, skip, limit)
+
+        if parts[0] == "tickets":
+            if len(parts) == 1 and method == "GET":
+                end = skip + limit if limit else store.n_tickets
+                return 200, [store.ticket(t) for t in range(skip + 1, min(end, store.n_tickets) + 1)]
+            if parts[1:] == ["search"]:
+                return 200, store.search_tickets(query, limit)
+            if len(parts) == 1 and method == "POST":
+                with store.lock:
+                    tid = max(store.n_tickets, *store.written) + 1 if store.written else store.n_tickets + 1
+                    store.written[tid] = {"ticket_id": tid, "status": "Open", **self._body()}
+                return 200, store.written[tid]
+            record = store.ticket(int(parts[1]))
+            if record is None:
+                return 404, {"detail": "Ticket not found"}
+            if method == "PUT":
+                with store.lock:
+                    store.written[record["ticket_id"]] = record = {**record, **self._body()}
+            return 200, record
+
+        if parts[0] in ("customers", "employees"):
+            records = store.customers if parts[0] == "customers" else store.employees
+            id_field = parts[0][:-1] + "_id"
+            if len(parts) == 1 and method == "GET":
+                return 200, records[skip:skip + limit] if limit else records[skip:]
+            if parts[1:] == ["search"]:
+                found = [r for r in records if _match(r, query)]
+                return 200, found[:limit] if limit else found
+            if len(parts) == 1 and method == "POST":
+                with store.lock:
+                    records.append({id_field: len(records) + 1, **self._body()})
+                return 200, records[-1]
+            index = int(parts[1]) - 1
+            if not 0 <= index < len(records):
+                return 404, {"detail": f"{parts[0][:-1].title()} not found"}
+            if method == "PUT":
+                records[index].update(self._body())
+            return 200, records[index]
+
+        return 404, {"detail": "Not Found"}
+
+    def chat(self, method: str, parts: list, query: dict, skip: int, limit):
+        chats = self.server.store.chats
+        if not parts and method == "GET":
+            chat_id = len(chats) + 1
+            chats[chat_id] = []
+            return 200, {"new_id": chat_id}
+        if not parts and method == "POST":
+            body = self._body()
+            chats.setdefault(body["chat_id"], []).append(body)
+            return 200, body
+        if parts == ["sessions"]:
+            return 200, [{"chat_id": cid, "init_time": None} for cid in chats]
+        if parts == ["sessions", "summary"]:
+            offset = int(query.get("offset", 0))
+            items = [{"chat_id": cid, "init_time": None, "title": None, "message_count": len(msgs)}
+                     for cid, msgs in sorted(chats.items(), reverse=True)]
+            return 200, items[offset:offset + (limit or len(items))]
+        if parts[0] == "messages":
+            messages = chats.get(int(parts[1]), [])
+            return 200, messages[skip:skip + limit] if limit else messages[skip:]
+        return 404, {"detail": "Not Found"}
+
+
+def serve(port: int = 0, tickets: int = 10000, customers: int = 1000, employees: int = 50) -> StubCRM:
+    """
+    Start the stub on a background thread.
+
+    :param port: Port to bind, 0 picks a free one
+    :return: The server, its URL is http://127.0.0.1:<server.server_port>
+    """
+    server = StubCRM(("127.0.0.1", port), Store(tickets, customers, employees))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--tickets", type=int, default=10000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--employees", type=int, default=50)
+    args = parser.parse_args()
+
+    server = StubCRM(("127.0.0.1", args.port), Store(args.tickets, args.customers, args.employees))
+    print(f"Stub CRM with {args.tickets} tickets on http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
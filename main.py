@@ -1,7 +1,12 @@
 import streamlit as st
 
+from utils import tracing
+
 st.set_page_config(layout="wide",page_title="AI CRM Assistant")
 
+# Prometheus metrics of the turns, if CRM_METRICS_PORT is set.
+tracing.start_metrics_server()
+
 # Define the Pages needed for this application.
 login_page = st.Page("views/login_view.py",title="Login",icon=":material/login:")
 chat_page = st.Page("views/chat_view.py",title="AI Assistant",icon=":material/chat:")
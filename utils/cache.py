@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class EntityCache:
+    """
+    Size bounded LRU cache with a time to live, keyed by API path and query params.
+
+    Used under the tools so repeated lookups of the same customers, employees or tickets within a
+    conversation are answered locally. Write tools invalidate the paths they touch.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 120):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(path: str, params: dict = None) -> tuple:
+        """
+        Build a cache key. Params that are None are ignored so equivalent queries share an entry.
+
+        :param path: API path, e.g. "/tickets/8"
+        :param params: Query parameters
+        :return: Hashable key
+        """
+        path = "/" + path.strip("/")
+        items = tuple(sorted((k, str(getattr(v, "value", v))) for k, v in (params or {}).items() if v is not None))
+        return path, items
+
+    def get(self, key: tuple):
+        """
+        :param key: Key from make_key
+        :return: (True, value) on a hit, (False, None) otherwise
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return False, None
+
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, value
+
+    def set(self, key: tuple, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, prefix: str):
+        """
+        Drop every entry whose path is the prefix or lies under it.
+
+        :param prefix: Path prefix, e.g. "/tickets"
+        """
+        prefix = "/" + prefix.strip("/")
+        with self._lock:
+            stale = [k for k in self._data if k[0] == prefix or k[0].startswith(prefix + "/")]
+            for key in stale:
+                del self._data[key]
+            self._stats["invalidations"] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def dump(self) -> list:
+        """
+        :return: [path, params, seconds left, value] of the live entries, oldest first, for a snapshot
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [[key[0], [list(item) for item in key[1]], expires - now, value]
+                    for key, (expires, value) in self._data.items() if expires > now]
+
+    def load(self, entries: list, age: float = 0):
+        """
+        Put back entries from dump(), minus the time that has passed since.
+
+        :param entries: Result of dump()
+        :param age: Seconds since the dump was taken
+        """
+        now = time.monotonic()
+        with self._lock:
+            for path, params, left, value in entries:
+                if left - age > 0:
+                    self._data[(path, tuple(tuple(item) for item in params))] = (now + left - age, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        :return: Hit/miss/eviction counters, current size and hit rate
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._data),
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0
+            }
@@ -1,7 +1,20 @@
-import requests
+from collections import OrderedDict
+
 import streamlit as st
 
-BASE_URL = "http://127.0.0.1:8000/chat"
+from utils import chat_queue
+from utils import crm_client as crm
+from utils import render
+from utils import snapshots
+
+# Number of past sessions shown in the sidebar per "Load more" click.
+SESSION_PAGE_SIZE = 20
+
+# Messages shown when a chat is opened, and added per "Load older messages" click.
+MESSAGE_PAGE_SIZE = 30
+
+# Chats whose loaded messages are kept in session state, most recently opened first.
+MAX_CACHED_CHATS = 10
 
 
 def get_chat_session():
@@ -11,12 +24,8 @@ def get_chat_session():
 
     :return: Id of the current chat session
     """
-    headers = st.session_state.headers
     try:
-        response = requests.get(
-            "http://127.0.0.1:8000/chat/",
-            headers=headers
-        )
+        response = crm.get_client().get("/chat/")
         data = response.json()
         return data["new_id"]
     except Exception as e:
@@ -30,12 +39,8 @@ def get_user_chats():
 
     :return: All sessions belonging to the current user.
     """
-    headers = st.session_state.get("headers", {})
     try:
-        response = requests.get(
-            f"{BASE_URL}/sessions",
-            headers=headers
-        )
+        response = crm.get_client().get("/chat/sessions")
         if response.status_code == 200:
             return response.json()
     except Exception as e:
@@ -43,45 +48,186 @@ def get_user_chats():
     return []
 
 
+def _fetch_session_summaries(offset: int, limit: int) -> list:
+    """
+    Fetch one page of session summaries (chat_id, init_time, title, message_count), newest first.
+    Falls back to counting messages for just this page if the server has no summary route.
+
+    :param offset: Number of sessions to skip
+    :param limit: Number of sessions to return
+    :return: Session summaries
+    """
+    response = crm.get_client().get("/chat/sessions/summary", params={"offset": offset, "limit": limit})
+    if response.status_code == 200:
+        return response.json()
+
+    sessions = get_user_chats()
+    sessions.sort(key=lambda x: x['chat_id'], reverse=True)
+    page = sessions[offset:offset + limit]
+    for session in page:
+        session["message_count"] = len(get_chat_messages(session["chat_id"]))
+    return page
+
+
+def get_session_summaries() -> dict:
+    """
+    Summaries of the user's sessions for the sidebar. Cached in session state until a new message is sent.
+
+    :return: {"items": [session summaries], "has_more": bool}
+    """
+    if "session_summaries" not in st.session_state:
+        limit = st.session_state.get("session_pages", 1) * SESSION_PAGE_SIZE
+        try:
+            items = _fetch_session_summaries(0, limit)
+        except Exception as e:
+            st.error(e)
+            return {"items": [], "has_more": False}
+        st.session_state["session_summaries"] = {"items": items, "has_more": len(items) >= limit}
+    return st.session_state["session_summaries"]
+
+
+def load_more_sessions():
+    """
+    Append the next page of older sessions to the cached summaries.
+    """
+    summaries = get_session_summaries()
+    try:
+        page = _fetch_session_summaries(len(summaries["items"]), SESSION_PAGE_SIZE)
+    except Exception as e:
+        st.error(e)
+        return
+    summaries["items"].extend(page)
+    summaries["has_more"] = len(page) >= SESSION_PAGE_SIZE
+    st.session_state["session_pages"] = st.session_state.get("session_pages", 1) + 1
+
+
+def invalidate_session_summaries():
+    st.session_state.pop("session_summaries", None)
+
+
 def get_chat_messages(chat_id: int):
     """
-    Get all the messages for a given session using chat_id
+    Get all the messages for a given session using chat_id. Messages still waiting in the write-behind
+    queue are appended, so a chat never shows fewer messages than were sent.
 
     :param chat_id:
     :return: All messages belonging to chat ID
     """
-    headers = st.session_state.get("headers", {})
+    messages = []
     try:
-        response = requests.get(
-            f"{BASE_URL}/messages/{chat_id}",
-            headers=headers
-        )
+        response = crm.get_client().get(f"/chat/messages/{chat_id}")
         if response.status_code == 200:
-            return response.json()
+            messages = response.json()
     except Exception as e:
         st.error(e)
-    return []
+    return messages + chat_queue.pending(chat_id)
+
+
+def _view_message(m: dict) -> dict:
+    text, artifacts = render.decode_message(m['chat_text'])
+    return {"role": "user" if m['sender_type'] == "user" else "ai", "content": text, "artifacts": artifacts}
+
+
+def _message_count(chat_id: int):
+    for session in st.session_state.get("session_summaries", {}).get("items", []):
+        if session["chat_id"] == chat_id:
+            return session.get("message_count")
+    return None
+
+
+def _fetch_messages(chat_id: int, skip: int = None, limit: int = None) -> list:
+    params = {"skip": skip, "limit": limit} if limit is not None else None
+    response = crm.get_client().get(f"/chat/messages/{chat_id}", params=params)
+    if response.status_code != 200:
+        raise ValueError(f"Could not load messages of chat {chat_id} - {response.text[:200]}")
+    return response.json()
+
+
+def get_chat_window(chat_id: int) -> dict:
+    """
+    The loaded messages of a chat, newest MESSAGE_PAGE_SIZE first. Kept in session state, so switching back
+    to a chat does not fetch or decode it again.
+
+    The window is sliced with `skip`/`limit` when the sidebar summary knows the message count. A server
+    that ignores the slice returns the whole chat, which is then kept to serve older pages locally.
+
+    :param chat_id:
+    :return: {"messages": [view messages, oldest first], "has_more": bool}
+    """
+    windows = st.session_state.setdefault("chat_windows", OrderedDict())
+    if chat_id in windows:
+        windows.move_to_end(chat_id)
+        return windows[chat_id]
+
+    count = _message_count(chat_id)
+    full = None
+    try:
+        if count is None:
+            full = _fetch_messages(chat_id)
+            start = max(len(full) - MESSAGE_PAGE_SIZE, 0)
+            page = full[start:]
+        else:
+            start = max(count - MESSAGE_PAGE_SIZE, 0)
+            page = _fetch_messages(chat_id, start, MESSAGE_PAGE_SIZE)
+            if len(page) > MESSAGE_PAGE_SIZE:
+                full, start = page, max(len(page) - MESSAGE_PAGE_SIZE, 0)
+                page = full[start:]
+    except Exception as e:
+        st.error(e)
+        return {"messages": [], "has_more": False}
+
+    page = page + chat_queue.pending(chat_id)
+    windows[chat_id] = {"messages": [_view_message(m) for m in page], "has_more": start > 0,
+                        "start": start, "full": full}
+    while len(windows) > MAX_CACHED_CHATS:
+        windows.popitem(last=False)
+    return windows[chat_id]
+
+
+def load_older_messages(chat_id: int):
+    """
+    Prepend the previous MESSAGE_PAGE_SIZE messages to the loaded window of a chat.
+    """
+    window = get_chat_window(chat_id)
+    start = max(window["start"] - MESSAGE_PAGE_SIZE, 0)
+    try:
+        if window["full"] is not None:
+            page = window["full"][start:window["start"]]
+        else:
+            page = _fetch_messages(chat_id, start, window["start"] - start)
+    except Exception as e:
+        st.error(e)
+        return
+    # In place, the page holds on to this list to append new messages.
+    window["messages"][:0] = [_view_message(m) for m in page]
+    window["start"] = start
+    window["has_more"] = start > 0
 
 
 def send_message(role: str, message: str, chat_id: int):
     """
-    Send Message to API for the current Chat Session
+    Send Message to API for the current Chat Session. The message is queued and posted in the background,
+    the page does not wait for the API.
 
     :param role:
     :param message:
     :param chat_id:
     """
-    payload = {
-        "sender_type": role,
-        "chat_text": message,
-        "chat_id": chat_id
-    }
-    headers = st.session_state.get("headers", {})
     try:
-        requests.post(
-            f"{BASE_URL}",
-            headers=headers,
-            json=payload
-        )
+        chat_queue.put(role, message, chat_id, st.session_state.get("current_emp"),
+                       crm.get_client().session_headers())
+        invalidate_session_summaries()
     except Exception as e:
         st.error(e)
+
+
+def logout():
+    """
+    Send the queued messages of the session, then forget the user and go back to the login page.
+    The next login starts a new chat instead of resuming this one.
+    """
+    if not chat_queue.flush(st.session_state.get("current_emp")):
+        st.toast("Some messages are still being saved in the background.")
+    snapshots.remove(st.session_state.get("current_emp"), st.session_state.get("live_chat_id"))
+    st.session_state.clear()
+    st.rerun()
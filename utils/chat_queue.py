@@ -0,0 +1,285 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from utils import crm_client as crm
+from utils import tracing
+
+DEFAULT_JOURNAL_FILE = os.path.join("logs", "chat_journal.jsonl")
+
+# Messages one chat may post per pass before the worker moves on to the next chat.
+BATCH_SIZE = 50
+
+# Backoff of a chat whose POST failed, doubling per failure up to MAX_BACKOFF seconds.
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+# Seconds logout and process exit wait for the queue to drain.
+FLUSH_TIMEOUT = 5
+
+# Client errors worth retrying. Any other 4xx means the API refused the message for good.
+RETRY_STATUS = {408, 425, 429}
+
+# Expired or revoked token. The messages are kept until their employee sends again with fresh headers.
+AUTH_STATUS = {401, 403}
+
+
+class ChatQueue:
+    """
+    Write-behind queue for chat messages, shared by all sessions of the process.
+
+    The page only appends a message to a local journal and returns; a worker thread posts it to the API.
+    Messages of one chat are posted strictly in order, a failing chat waits with backoff without holding up
+    other chats. The journal lets messages survive a restart: entries never acknowledged by the API are
+    loaded again and sent once their employee logs in, since auth headers are never written to disk. A chat
+    whose token was rejected is parked the same way until its employee queues a message with new headers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Condition()
+        self._wake = threading.Event()
+        self._chats = OrderedDict()
+        self._orphans = {}
+        self._seq = 0
+        self._journal = None
+        self._journal_lines = 0
+        self._worker = None
+        # The worker has no session, so it cannot use the client of one.
+        self._client = None
+        self.stats = {"queued": 0, "sent": 0, "retries": 0, "held": 0, "dropped": 0}
+
+    def start(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._load_journal()
+            self._worker = threading.Thread(target=self._run, name="crm-chat-queue", daemon=True)
+            self._worker.start()
+
+    def put(self, role: str, message: str, chat_id: int, emp, headers: dict):
+        """
+        Queue a message. Returns once it is in the journal.
+
+        :param role: "user" or "ai"
+        :param message: Chat text
+        :param chat_id: Chat session of the message
+        :param emp: current_emp, owner of the message
+        :param headers: Auth headers to post it with
+        """
+        self.start()
+        with self._lock:
+            self._seq += 1
+            entry = {"seq": self._seq, "chat_id": chat_id, "sender_type": role, "chat_text": message, "emp": emp}
+            self._write({"op": "add", **entry})
+            # Messages left over from an earlier process go first, they were written before this one.
+            for orphan in self._orphans.pop(emp, []):
+                self._enqueue(orphan, headers)
+            self._enqueue(entry, headers)
+            self.stats["queued"] += 1
+        self._wake.set()
+
+    def _enqueue(self, entry: dict, headers: dict):
+        chat = self._chats.setdefault(entry["chat_id"], {"items": deque(), "retry_at": 0.0, "failures": 0})
+        chat["items"].append((entry, headers))
+
+    def pending(self, chat_id: int) -> list:
+        """
+        Messages of a chat not yet acknowledged by the API, oldest first, shaped like the /chat/messages rows.
+        """
+        with self._lock:
+            chat = self._chats.get(chat_id)
+            entries = [entry for entry, _ in chat["items"]] if chat else []
+            entries += [e for orphans in self._orphans.values() for e in orphans if e["chat_id"] == chat_id]
+        entries.sort(key=lambda e: e["seq"])
+        return [{k: e[k] for k in ("chat_id", "sender_type", "chat_text")} for e in entries]
+
+    def flush(self, emp=None, timeout: float = FLUSH_TIMEOUT) -> bool:
+        """
+        Retry the waiting chats of an employee right away and wait for them to drain. Chats of other
+        employees keep their backoff.
+
+        :param emp: current_emp whose chats to flush, None for the whole queue (process exit)
+        :return: True if nothing is left to send, apart from messages held for fresh headers
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            for chat in self._owned(emp):
+                chat["retry_at"] = 0.0
+            self._wake.set()
+            while self._owned(emp):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._worker is None:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    def _owned(self, emp) -> list:
+        return [chat for chat in self._chats.values()
+                if emp is None or any(entry["emp"] == emp for entry, _ in chat["items"])]
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self._next_retry())
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                ready = [chat_id for chat_id, chat in self._chats.items() if chat["retry_at"] <= now]
+            for chat_id in ready:
+                self._send_chat(chat_id)
+            with self._lock:
+                if not self._chats:
+                    self._compact()
+                self._lock.notify_all()
+
+    def _next_retry(self):
+        with self._lock:
+            if not self._chats:
+                return None
+            return max(min(chat["retry_at"] for chat in self._chats.values()) - time.monotonic(), 0.01)
+
+    def _send_chat(self, chat_id: int):
+        if self._client is None:
+            self._client = crm.CRMClient()
+        with self._lock:
+            chat = self._chats[chat_id]
+        for _ in range(BATCH_SIZE):
+            with self._lock:
+                if not chat["items"]:
+                    del self._chats[chat_id]
+                    return
+                entry, headers = chat["items"][0]
+
+            payload = {k: entry[k] for k in ("sender_type", "chat_text", "chat_id")}
+            try:
+                status = self._client.post("/chat", json=payload, headers=headers).status_code
+            except Exception:
+                status = None
+
+            with self._lock:
+                if status is not None and status < 400:
+                    self.stats["sent"] += 1
+                elif status is None or status >= 500 or status in RETRY_STATUS:
+                    chat["failures"] += 1
+                    chat["retry_at"] = time.monotonic() + min(BASE_BACKOFF * 2 ** (chat["failures"] - 1),
+                                                              MAX_BACKOFF)
+                    self.stats["retries"] += 1
+                    return
+                elif status in AUTH_STATUS:
+                    self._hold(chat_id, chat)
+                    return
+                else:
+                    self.stats["dropped"] += 1
+                chat["items"].popleft()
+                chat["failures"] = 0
+                self._write({"op": "done", "seq": entry["seq"]})
+
+    def _hold(self, chat_id: int, chat: dict):
+        """
+        Park the messages of a chat whose headers were rejected with the orphans, still journaled and still
+        pending, until put() brings fresh headers for their employee.
+        """
+        for entry, _ in chat["items"]:
+            self._orphans.setdefault(entry["emp"], []).append(entry)
+            self.stats["held"] += 1
+        for orphans in self._orphans.values():
+            orphans.sort(key=lambda e: e["seq"])
+        del self._chats[chat_id]
+
+    def _write(self, record: dict):
+        if self._journal is None:
+            return
+        try:
+            self._journal.write(json.dumps(record, default=str) + "\n")
+            self._journal.flush()
+            self._journal_lines += 1
+        except OSError:
+            # A full disk costs durability, not the message; it is still queued in memory.
+            pass
+
+    def _load_journal(self):
+        """
+        Read the entries a previous process left unacknowledged and start a fresh journal with just them.
+        """
+        left = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last line of a crashed process may be cut off.
+                        continue
+                    if record.pop("op", None) == "add":
+                        left[record["seq"]] = record
+                    else:
+                        left.pop(record.get("seq"), None)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return
+
+        for entry in sorted(left.values(), key=lambda e: e["seq"]):
+            self._orphans.setdefault(entry["emp"], []).append(entry)
+        self._seq = max(left, default=0)
+        self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the journal with only the entries still waiting, once it has grown past what is needed.
+        """
+        if self._journal is not None and self._journal_lines < 1000:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if self._journal is not None:
+                self._journal.close()
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                for orphans in self._orphans.values():
+                    for entry in orphans:
+                        f.write(json.dumps({"op": "add", **entry}, default=str) + "\n")
+            os.replace(self.path + ".tmp", self.path)
+            self._journal = open(self.path, "a", encoding="utf-8")
+            self._journal_lines = sum(len(orphans) for orphans in self._orphans.values())
+        except OSError:
+            self._journal = None
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(chat["items"]) for chat in self._chats.values())
+
+
+_queue = ChatQueue(os.environ.get("CRM_CHAT_JOURNAL", DEFAULT_JOURNAL_FILE))
+
+
+def put(role: str, message: str, chat_id: int, emp, headers: dict):
+    _queue.put(role, message, chat_id, emp, headers)
+
+
+def pending(chat_id: int) -> list:
+    return _queue.pending(chat_id)
+
+
+def flush(emp=None, timeout: float = FLUSH_TIMEOUT) -> bool:
+    return _queue.flush(emp, timeout)
+
+
+def stats() -> dict:
+    return {**_queue.stats, "waiting": len(_queue)}
+
+
+def _metrics() -> list:
+    counters = stats()
+    waiting = counters.pop("waiting")
+    return [
+        ("crm_chat_queue_messages_total", "counter", "Chat messages queued, sent, retried, held for fresh headers "
+         "and dropped.", [({"outcome": outcome}, count) for outcome, count in counters.items()]),
+        ("crm_chat_queue_waiting", "gauge", "Chat messages waiting to be posted.", [({"scope": "process"}, waiting)]),
+    ]
+
+
+tracing.add_metrics(_metrics)
+atexit.register(flush)
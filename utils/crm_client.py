@@ -0,0 +1,301 @@
+import os
+import re
+import threading
+import time
+import weakref
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import tracing
+from utils.cache import EntityCache
+
+DEFAULT_BASE_URL = "http://127.0.0.1:8000"
+
+# (connect, read) timeout in seconds applied when a call does not pass its own.
+DEFAULT_TIMEOUT = (3.05, 20)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+# Clients are per session. The live ones and the totals of those already gone feed the process wide metrics.
+_clients = weakref.WeakSet()
+_retired = {"latency": {}, "cache": {}}
+_registry_lock = threading.RLock()
+
+
+def get_base_url() -> str:
+    """
+    Resolve the CRM API base url. `CRM_BASE_URL` env variable wins over the `crm_base_url` secret.
+
+    :return: Base url without a trailing slash
+    """
+    url = os.environ.get("CRM_BASE_URL")
+    if not url:
+        try:
+            url = st.secrets.get("crm_base_url")
+        except Exception:
+            url = None
+    return (url or DEFAULT_BASE_URL).rstrip("/")
+
+
+class CRMClient:
+    """
+    Thin wrapper over a pooled `requests.Session` for the internal CRM API.
+
+    Connections are kept alive between calls, every call gets a timeout, idempotent GETs are retried with
+    backoff on connection errors and 502/503/504, and the latency of each endpoint is recorded.
+    """
+
+    def __init__(self, base_url: str = None, timeout=DEFAULT_TIMEOUT, retries: int = 3, backoff: float = 0.3,
+                 pool_size: int = 10):
+        self.base_url = (base_url or get_base_url()).rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._latency = {}
+        self.cache = EntityCache()
+        with _registry_lock:
+            _clients.add(self)
+        weakref.finalize(self, _retire, self._latency, self._lock, self.cache)
+
+    def request(self, method: str, path: str, headers: dict = None, timeout=None, **kwargs) -> requests.Response:
+        """
+        Send a request to the CRM API.
+
+        :param method: HTTP method
+        :param path: Path relative to the base url, e.g. "/tickets/8"
+        :param headers: Request headers. Defaults to the auth headers of the current user.
+        :param timeout: Per-call timeout, overrides the client default
+        :return: The response
+        """
+        if headers is None:
+            headers = self.session_headers()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        start = time.perf_counter()
+        failed = True
+        with tracing.span(self.endpoint(method, path), "http") as span:
+            try:
+                res = self.session.request(method, url, headers=headers, timeout=timeout or self.timeout, **kwargs)
+                failed = res.status_code >= 500
+                span.set(status_code=res.status_code, response_bytes=len(res.content),
+                         request_bytes=len(res.request.body or b""))
+                if res.status_code >= 400:
+                    span.fail(f"HTTP {res.status_code}")
+                return res
+            finally:
+                self._record(method, path, time.perf_counter() - start, failed)
+
+    @staticmethod
+    def session_headers() -> dict:
+        """
+        Auth headers of the current user. Read them before handing requests to threads that have no session.
+        """
+        return st.session_state.get("headers", {})
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def get_json(self, path: str, params: dict = None):
+        """
+        Read-through cached GET. Only successful responses are cached, error bodies are returned as they are.
+
+        :param path: Path relative to the base url
+        :param params: Query parameters
+        :return: Decoded JSON body
+        """
+        key = self.cache.make_key(path, params)
+        hit, data = self.cache.get(key)
+        if hit:
+            return data
+
+        res = self.get(path, params=params)
+        data = res.json()
+        if res.status_code == 200:
+            self.cache.set(key, data)
+        return data
+
+    def get_page(self, path: str, page: int = 1, page_size: int = 10) -> dict:
+        """
+        Fetch one page of a collection using `skip`/`limit`. Pages are cached like any other GET. If the
+        server ignores the slice and returns the whole collection, it is cached once and sliced locally. A
+        small collection comes back no longer than a page either way, so past page 1 a response starting with
+        the first row of page 1 is taken as unsliced too.
+
+        :param path: Collection path, e.g. "/tickets/"
+        :param page: 1-based page number
+        :param page_size: Rows per page
+        :return: {"rows", "page", "page_size", "has_more"} or the error body of the API
+        """
+        page = max(page, 1)
+        start = (page - 1) * page_size
+        # One extra row tells whether a next page exists.
+        params = {"skip": start, "limit": page_size + 1}
+        full_key = self.cache.make_key(path)
+        page_key = self.cache.make_key(path, params)
+
+        hit, data = self.cache.get(full_key)
+        if not hit:
+            hit, data = self.cache.get(page_key)
+            if not hit:
+                res = self.get(path, params=params)
+                data = res.json()
+                if res.status_code != 200 or not isinstance(data, list):
+                    return data
+                unsliced = len(data) > page_size + 1 or \
+                    (page > 1 and data and self._first_row(path, page_size) == data[0])
+                # An unsliced response is stored once, under the collection path only.
+                self.cache.set(full_key if unsliced else page_key, data)
+                hit = not unsliced
+            if hit:
+                return {"rows": data[:page_size], "page": page, "page_size": page_size,
+                        "has_more": len(data) > page_size}
+
+        return {"rows": data[start:start + page_size], "page": page, "page_size": page_size,
+                "has_more": len(data) > start + page_size}
+
+    def _first_row(self, path: str, page_size: int):
+        # Page 1 is usually cached already, it was shown before the later pages.
+        first = self.get_page(path, 1, page_size)
+        rows = first.get("rows") if isinstance(first, dict) else None
+        return rows[0] if rows else None
+
+    def invalidate(self, collection: str, record: dict = None, record_id=None):
+        """
+        Drop cached entries of a collection after a write. If the API returned the written record, it is
+        stored back under its by-id path so the next lookup does not hit the API.
+
+        :param collection: Collection name, e.g. "tickets"
+        :param record: Record returned by the API
+        :param record_id: Id of the record
+        """
+        self.cache.invalidate(f"/{collection}")
+        if isinstance(record, dict) and record_id is not None:
+            self.cache.set(self.cache.make_key(f"/{collection}/{record_id}"), record)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    @staticmethod
+    def endpoint(method: str, path: str) -> str:
+        return f"{method} /{_ID_SEGMENT.sub('/{id}', path.lstrip('/'))}"
+
+    def _record(self, method: str, path: str, elapsed: float, failed: bool):
+        endpoint = self.endpoint(method, path)
+        with self._lock:
+            entry = self._latency.setdefault(endpoint, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            ms = elapsed * 1000
+            entry["calls"] += 1
+            entry["errors"] += int(failed)
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+
+    def latency_stats(self) -> dict:
+        """
+        Per-endpoint call counts and latencies. Numeric path segments are folded into `{id}`.
+
+        :return: endpoint -> {calls, errors, total_ms, max_ms, avg_ms}
+        """
+        with self._lock:
+            return {
+                endpoint: {**entry, "avg_ms": entry["total_ms"] / entry["calls"]}
+                for endpoint, entry in self._latency.items()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+def _add_latency(total: dict, latency: dict):
+    for endpoint, entry in latency.items():
+        into = total.setdefault(endpoint, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        into["calls"] += entry["calls"]
+        into["errors"] += entry["errors"]
+        into["total_ms"] += entry["total_ms"]
+        into["max_ms"] = max(into["max_ms"], entry["max_ms"])
+
+
+def _add_cache(total: dict, stats: dict):
+    for name, count in stats.items():
+        if name not in ("size", "hit_rate"):
+            total[name] = total.get(name, 0) + count
+
+
+def _retire(latency: dict, lock, cache: EntityCache):
+    # Runs once the session's client is garbage collected; its counters stay in the process totals.
+    with lock:
+        latency = {endpoint: dict(entry) for endpoint, entry in latency.items()}
+    with _registry_lock:
+        _add_latency(_retired["latency"], latency)
+        _add_cache(_retired["cache"], cache.stats())
+
+
+def process_stats() -> dict:
+    """
+    CRM API latencies and entity cache counters summed over every client of the process, past sessions
+    included. The cache size counts live sessions only.
+
+    :return: {"latency": endpoint -> {calls, errors, total_ms, max_ms}, "cache": {hits, misses, ..., size}}
+    """
+    with _registry_lock:
+        clients = list(_clients)
+        latency = {endpoint: dict(entry) for endpoint, entry in _retired["latency"].items()}
+        cache = dict(_retired["cache"])
+    size = 0
+    for client in clients:
+        with client._lock:
+            _add_latency(latency, client._latency)
+        stats = client.cache.stats()
+        _add_cache(cache, stats)
+        size += stats["size"]
+    return {"latency": latency, "cache": {**cache, "size": size}}
+
+
+def _metrics() -> list:
+    stats = process_stats()
+    latency = sorted(stats["latency"].items())
+    return [
+        ("crm_api_requests_total", "counter", "CRM API calls per endpoint.",
+         [({"endpoint": endpoint}, entry["calls"]) for endpoint, entry in latency]),
+        ("crm_api_errors_total", "counter", "CRM API calls per endpoint that got a 5xx or no response.",
+         [({"endpoint": endpoint}, entry["errors"]) for endpoint, entry in latency]),
+        ("crm_api_request_seconds_total", "counter", "Time spent in CRM API calls per endpoint.",
+         [({"endpoint": endpoint}, entry["total_ms"] / 1000) for endpoint, entry in latency]),
+        ("crm_api_request_max_seconds", "gauge", "Slowest CRM API call per endpoint.",
+         [({"endpoint": endpoint}, entry["max_ms"] / 1000) for endpoint, entry in latency]),
+        ("crm_cache_events_total", "counter", "Entity cache hits, misses, evictions, expirations and invalidations.",
+         [({"event": event}, count) for event, count in stats["cache"].items() if event != "size"]),
+        ("crm_cache_entries", "gauge", "Entries in the entity caches of live sessions.",
+         [({"scope": "process"}, stats["cache"]["size"])]),
+    ]
+
+
+tracing.add_metrics(_metrics)
+
+
+def get_client() -> CRMClient:
+    """
+    Gives the CRM client of the current Streamlit session, creating it on first use.
+
+    :return: Session scoped CRMClient
+    """
+    if "crm_client" not in st.session_state:
+        st.session_state["crm_client"] = CRMClient()
+    return st.session_state["crm_client"]
@@ -0,0 +1,158 @@
+from utils import crm_client as crm
+
+# How each filter field is matched locally against a record.
+#   exact    -> values must be equal (ids)
+#   iexact   -> case-insensitive equality (enums, emails)
+#   contains -> case-insensitive substring match (free text)
+#   digits   -> equality after stripping everything but digits (phone numbers)
+TICKET_FILTERS = {
+    "title": "contains",
+    "description": "contains",
+    "customer_id": "exact",
+    "assignee_id": "exact",
+    "created_by_id": "exact",
+    "ticket_type": "iexact",
+    "priority": "iexact",
+    "status": "iexact",
+}
+
+CUSTOMER_FILTERS = {
+    "first_name": "contains",
+    "last_name": "contains",
+    "company": "contains",
+    "email": "iexact",
+    "phone": "digits",
+    "created_by": "exact",
+}
+
+EMPLOYEE_FILTERS = {
+    "first_name": "contains",
+    "last_name": "contains",
+    "email": "iexact",
+    "phone": "digits",
+    "access_level": "iexact",
+}
+
+# Query parameter names of a search route that differ from the record field they filter on.
+SEARCH_PARAMS = {
+    "tickets": {"assignee_id": "employee_id"},
+}
+
+# Filters each search route is known to apply. A limit is only sent along when every filter is one of them,
+# otherwise the server could cut the rows before the local re-check sees the ones that match.
+SERVER_FILTERS = {
+    "tickets": {"customer_id", "assignee_id"},
+}
+
+# Status codes meaning the search route does not exist or rejected the filters.
+UNSUPPORTED_STATUS = {404, 405, 422}
+
+
+def _plain(value):
+    """
+    Unwrap enum members to their raw value so they compare and encode as plain strings.
+    """
+    return getattr(value, "value", value)
+
+
+def _digits(value) -> str:
+    return "".join(ch for ch in str(value) if ch.isdigit())
+
+
+def build_query(filters: dict, spec: dict) -> dict:
+    """
+    Drop empty filters and unknown fields and turn the rest into query parameters.
+
+    :param filters: Filters given to the tool
+    :param spec: Field -> match mode mapping for the entity
+    :return: Query parameters to send to the search endpoint
+    """
+    return {
+        field: _plain(value)
+        for field, value in filters.items()
+        if field in spec and value is not None and value != ""
+    }
+
+
+def matches(record: dict, query: dict, spec: dict) -> bool:
+    """
+    Check a single record against every filter of the query.
+
+    :param record: Entity as returned by the API
+    :param query: Output of build_query
+    :param spec: Field -> match mode mapping for the entity
+    :return: True if the record satisfies all filters
+    """
+    for field, wanted in query.items():
+        actual = _plain(record.get(field))
+        if actual is None:
+            return False
+
+        mode = spec.get(field, "exact")
+        if mode == "exact":
+            if str(actual) != str(wanted):
+                return False
+        elif mode == "iexact":
+            if str(actual).casefold() != str(wanted).casefold():
+                return False
+        elif mode == "contains":
+            if str(wanted).casefold() not in str(actual).casefold():
+                return False
+        elif mode == "digits":
+            if _digits(actual) != _digits(wanted):
+                return False
+    return True
+
+
+def apply_filters(records: list, query: dict, spec: dict, limit: int = None) -> list:
+    """
+    Exact local filter engine. Used to enforce filters the server could not apply.
+
+    :param records: Entities to filter
+    :param query: Output of build_query
+    :param spec: Field -> match mode mapping for the entity
+    :param limit: Maximum number of records to return
+    :return: Matching records in their original order
+    """
+    result = [r for r in records if isinstance(r, dict) and matches(r, query, spec)]
+    if limit:
+        result = result[:limit]
+    return result
+
+
+def search_records(entity: str, filters: dict, spec: dict, limit: int = None) -> list:
+    """
+    Send the filters as query parameters to `/<entity>/search`. The response is re-checked locally so that
+    filters the server ignores are still applied, and the limit is applied after that check. If the search
+    route is unavailable, the collection is fetched once and filtered entirely in Python.
+
+    :param entity: Collection name, e.g. "tickets"
+    :param filters: Filters given to the tool
+    :param spec: Field -> match mode mapping for the entity
+    :param limit: Maximum number of records to return
+    :return: Matching records
+    """
+    query = build_query(filters, spec)
+    names = SEARCH_PARAMS.get(entity, {})
+    params = {names.get(field, field): value for field, value in query.items()}
+    if limit and set(query) <= SERVER_FILTERS.get(entity, set()):
+        params["limit"] = limit
+
+    client = crm.get_client()
+    key = client.cache.make_key(f"/{entity}/search", params)
+    hit, data = client.cache.get(key)
+    if not hit:
+        res = client.get(f"/{entity}/search", params=params)
+        if res.status_code in UNSUPPORTED_STATUS:
+            res = client.get(f"/{entity}/")
+        res.raise_for_status()
+        data = res.json()
+        if isinstance(data, dict):
+            data = [data]
+        # Only the matches are cached: a fallback response is the whole collection, and a copy of it per
+        # filter set would fill the session cache and every snapshot taken from it.
+        data = apply_filters(data, query, spec)
+        client.cache.set(key, data)
+
+    # A copy, callers must not change the cached list.
+    return data[:limit] if limit else data[:]
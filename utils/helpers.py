@@ -1,6 +1,8 @@
 import requests
 import streamlit as st
 
+from utils import crm_client as crm
+
 
 def check_user_login(email: str, password: str):
     """
@@ -20,7 +22,7 @@ def check_user_login(email: str, password: str):
         "password": password
     }
     try:
-        response = requests.post("http://127.0.0.1:8000/login/", data=payload)
+        response = crm.get_client().post("/login/", data=payload, headers={})
         if response.status_code == 200:
             data = response.json()
             st.session_state["access_token"] = data["access_token"]
@@ -59,3 +61,22 @@ def get_clean_message(msg):
                 return line.get("text","")
             if hasattr(line,"text"):
                 return line.text
+
+
+def get_chunk_text(chunk) -> str:
+    """
+    Extracts the text carried by a single streamed message chunk.
+
+    :param chunk: Message chunk given by the LLM stream
+    :return: Text of the chunk, empty if it only carries tool call data
+    """
+    if isinstance(chunk.content, str):
+        return chunk.content
+
+    text = ""
+    for part in chunk.content:
+        if isinstance(part, str):
+            text += part
+        elif isinstance(part, dict) and part.get("type") == "text":
+            text += part.get("text", "")
+    return text
@@ -0,0 +1,325 @@
+import bisect
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+import streamlit as st
+
+from utils import crm_client as crm
+
+# How long an index is trusted before it is rebuilt from the API in the background. Writes made through the
+# tools are applied immediately, this only bounds how stale changes made elsewhere can get.
+REFRESH_SECONDS = 600
+
+# After a failed first load, lookups of the scope fail right away for this long before it is retried.
+RETRY_SECONDS = 30
+
+# Indexes kept, one per scope and entity. The least recently used are dropped and rebuilt when needed again.
+MAX_INDEXES = 64
+
+# Minimum trigram similarity for a fuzzy candidate.
+MIN_SIMILARITY = 0.3
+
+# entity -> (id field, fields shown next to each candidate)
+ENTITIES = {
+    "customers": ("customer_id", ("email", "company")),
+    "employees": ("employee_id", ("email", "access_level")),
+}
+
+
+def normalize(text: str) -> str:
+    """
+    Casefold, strip accents and punctuation, collapse whitespace. "  José  O'Neil" -> "jose o neil".
+    """
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in text).split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Name -> id lookup over one entity. Three layers, best score wins per record:
+      - exact:  the full name, or one of its words, equals the query (1.0 / 0.9)
+      - prefix: every word of the query starts a word of the name (0.75 - 0.85)
+      - fuzzy:  trigram similarity of the full name, for typos (up to 0.7)
+
+    Words and trigrams point at distinct names rather than records, so a name shared by hundreds of
+    records costs the same to match as a unique one.
+    """
+
+    def __init__(self, id_field: str, extra_fields: tuple = ()):
+        self.id_field = id_field
+        self.extra_fields = extra_fields
+        self._lock = threading.RLock()
+        self.built_at = None
+        self._pending = None
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._names = {}
+            self._words = {}
+            self._sorted_words = []
+            self._grams = {}
+
+    def record_writes(self):
+        """
+        Remember the records upserted from now on, so build() can replay the writes that raced the load of
+        its data.
+        """
+        with self._lock:
+            self._pending = []
+
+    def drop_writes(self):
+        """
+        Stop remembering upserted records, after a load that did not lead to a build().
+        """
+        with self._lock:
+            self._pending = None
+
+    def build(self, records: list):
+        with self._lock:
+            pending, self._pending = self._pending or [], None
+            self.clear()
+            for record in records:
+                self._add(record, keep_sorted=False)
+            self._sorted_words.sort()
+            self.built_at = time.monotonic()
+            for record in pending:
+                self.upsert(record)
+
+    def upsert(self, record: dict):
+        """
+        Add a record, or re-index it after an update. Records without an id are ignored.
+        """
+        if not isinstance(record, dict) or record.get(self.id_field) is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(record)
+            old = self._entries.get(record[self.id_field])
+            # Partial update responses keep the fields they do not mention.
+            self._add({**old, **record} if old else record)
+
+    def _add(self, record: dict, keep_sorted: bool = True):
+        if not isinstance(record, dict) or record.get(self.id_field) is None:
+            return
+        record_id = record[self.id_field]
+        self.remove(record_id)
+
+        norm = normalize(f"{record.get('first_name') or ''} {record.get('last_name') or ''}")
+        self._entries[record_id] = {
+            self.id_field: record_id, "first_name": record.get("first_name"),
+            "last_name": record.get("last_name"), "_norm": norm,
+            **{f: record.get(f) for f in self.extra_fields},
+        }
+        if norm in self._names:
+            self._names[norm].add(record_id)
+            return
+
+        self._names[norm] = {record_id}
+        for word in set(norm.split()):
+            if word not in self._words:
+                self._words[word] = set()
+                if keep_sorted:
+                    bisect.insort(self._sorted_words, word)
+                else:
+                    self._sorted_words.append(word)
+            self._words[word].add(norm)
+        for gram in trigrams(norm):
+            self._grams.setdefault(gram, set()).add(norm)
+
+    def remove(self, record_id):
+        with self._lock:
+            entry = self._entries.pop(record_id, None)
+            if entry is None:
+                return
+            norm = entry["_norm"]
+            self._names[norm].discard(record_id)
+            if self._names[norm]:
+                return
+
+            # Last record with this name.
+            del self._names[norm]
+            for word in set(norm.split()):
+                self._words[word].discard(norm)
+                if not self._words[word]:
+                    del self._words[word]
+                    del self._sorted_words[bisect.bisect_left(self._sorted_words, word)]
+            for gram in trigrams(norm):
+                self._grams[gram].discard(norm)
+
+    def _prefixed(self, prefix: str) -> set:
+        i = bisect.bisect_left(self._sorted_words, prefix)
+        found = set()
+        while i < len(self._sorted_words) and self._sorted_words[i].startswith(prefix):
+            found |= self._words[self._sorted_words[i]]
+            i += 1
+        return found
+
+    def _count(self, names: dict) -> int:
+        return sum(len(self._names[norm]) for norm in names)
+
+    def lookup(self, name: str, limit: int = 5) -> list:
+        """
+        :param name: Full name, first or last name, a prefix of them or a misspelling
+        :param limit: Maximum number of candidates
+        :return: Best candidates, highest score first, each with `score` and `match`
+        """
+        query = normalize(name)
+        if not query:
+            return []
+        words = query.split()
+        scores = {}
+
+        def offer(norm, score, match):
+            if score > scores.get(norm, (0, None))[0]:
+                scores[norm] = (score, match)
+
+        with self._lock:
+            if query in self._names:
+                offer(query, 1.0, "exact")
+            if len(words) == 1:
+                for norm in self._words.get(query, ()):
+                    offer(norm, 0.9, "exact")
+
+            prefixed = None
+            for word in words:
+                names = self._prefixed(word)
+                prefixed = names if prefixed is None else prefixed & names
+            for norm in prefixed or ():
+                offer(norm, 0.75 + 0.1 * min(len(query) / max(len(norm), 1), 1.0), "prefix")
+
+            # Fuzzy matches score below every exact or prefix match, only look for them if those ran short.
+            if self._count(scores) < limit:
+                grams = trigrams(query)
+                shared = Counter(norm for gram in grams for norm in self._grams.get(gram, ()))
+                for norm, common in shared.items():
+                    similarity = 2 * common / (len(grams) + len(norm) + 1)
+                    if similarity >= MIN_SIMILARITY:
+                        offer(norm, 0.7 * similarity, "fuzzy")
+
+            found = []
+            for norm, (score, match) in sorted(scores.items(), key=lambda item: (-item[1][0], item[0])):
+                for record_id in sorted(self._names[norm]):
+                    entry = self._entries[record_id]
+                    found.append({**{k: v for k, v in entry.items() if not k.startswith("_")},
+                                  "score": round(score, 3), "match": match})
+                    if len(found) >= limit:
+                        return found
+            return found
+
+    def count(self, name: str) -> int:
+        """
+        :return: Number of records whose name equals `name` after normalization
+        """
+        with self._lock:
+            return len(self._names.get(normalize(name), ()))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# (scope, entity) -> its index, the lock its first load is made under and when that load last failed, and
+# the keys whose index is being rebuilt.
+_indexes = OrderedDict()
+_loading = {}
+_failed = {}
+_refreshing = set()
+_lock = threading.Lock()
+
+
+def scope() -> str:
+    """
+    Auth scope of the current session: the logged in employee. Nothing guarantees the API shows the same
+    records to every employee, even of one access level, so an index built with the headers of one employee
+    only answers that employee.
+    """
+    return str(st.session_state.get("current_emp") or "")
+
+
+def get_index(entity: str) -> NameIndex:
+    """
+    The index of an entity shared by the sessions of the current scope. The first call of a scope builds it
+    with the session's headers; once it is older than REFRESH_SECONDS it keeps answering while a background
+    thread rebuilds it.
+
+    :param entity: "customers" or "employees"
+    """
+    client = crm.get_client()
+    headers = client.session_headers()
+    key = (scope(), entity)
+    with _lock:
+        if key not in _indexes:
+            id_field, extra = ENTITIES[entity]
+            _indexes[key] = NameIndex(id_field, extra)
+            _loading[key] = threading.Lock()
+        index = _indexes[key]
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_INDEXES:
+            old, _ = _indexes.popitem(last=False)
+            _loading.pop(old, None)
+            _failed.pop(old, None)
+        stale = index.built_at is not None and time.monotonic() - index.built_at > REFRESH_SECONDS and \
+            key not in _refreshing
+        if stale:
+            _refreshing.add(key)
+    if index.built_at is None:
+        _first_load(key, index, client, headers)
+    elif stale:
+        threading.Thread(target=_refresh, args=(key, index, client, headers), name="crm-name-index",
+                         daemon=True).start()
+    return index
+
+
+def _load(entity: str, client, headers) -> list:
+    # Plain GET, the whole collection is not worth a place in the entity cache.
+    data = client.get(f"/{entity}/", headers=headers).json()
+    if not isinstance(data, list):
+        raise ValueError(f"Could not load {entity} - {data}")
+    return data
+
+
+def _first_load(key: tuple, index: NameIndex, client, headers):
+    # Only lookups of the same scope and entity wait for the download, and a failing API is not asked again
+    # by every lookup until RETRY_SECONDS have passed.
+    with _loading[key]:
+        if index.built_at is not None:
+            return
+        if time.monotonic() - _failed.get(key, float("-inf")) < RETRY_SECONDS:
+            raise ValueError(f"The {key[1]} index could not be loaded, try again later")
+        try:
+            index.build(_load(key[1], client, headers))
+        except Exception:
+            _failed[key] = time.monotonic()
+            raise
+        _failed.pop(key, None)
+
+
+def _refresh(key: tuple, index: NameIndex, client, headers):
+    try:
+        index.record_writes()
+        index.build(_load(key[1], client, headers))
+    except Exception:
+        # Keep serving the current data, the next lookup past REFRESH_SECONDS tries again.
+        index.drop_writes()
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def upsert(entity: str, record: dict):
+    """
+    Keep the index of the current scope up to date after a create or update. Does nothing until it has been
+    built; indexes of other scopes pick the change up at their next rebuild.
+    """
+    index = _indexes.get((scope(), entity))
+    if index is not None and index.built_at is not None:
+        index.upsert(record)
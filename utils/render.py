@@ -0,0 +1,83 @@
+import json
+
+import pandas as pd
+import streamlit as st
+
+# Rendered tool results are stored at the end of the persisted chat text, hidden from the markdown.
+ARTIFACT_MARKER = "\n\n<!--crm-artifacts:"
+ARTIFACT_END = "-->"
+
+FIELD_ICONS = {
+    "Open": "🟢", "In Progress": "🟡", "Closed": "⚪",
+    "Critical": "🔴", "High": "🟠", "Medium": "🟡", "Low": "🔵",
+    "Bug": "🐞", "Feature Request": "✨", "Inquiry": "❓", "Billing": "💳", "Access": "🔑",
+    "admin": "🛡️", "agent": "🎧",
+}
+
+
+def encode_message(text: str, artifacts: list) -> str:
+    """
+    Attach rendered tool results to a chat message so past chats can be replayed.
+
+    :param text: Narrative written by the LLM
+    :param artifacts: Artifacts returned by the tools during the turn
+    :return: Text to persist
+    """
+    if not artifacts:
+        return text
+    return f"{text}{ARTIFACT_MARKER}{json.dumps(artifacts, default=str)}{ARTIFACT_END}"
+
+
+def decode_message(chat_text: str):
+    """
+    Split a persisted chat message into its narrative and its artifacts.
+
+    :param chat_text: Text as stored by the chat API
+    :return: (text, artifacts)
+    """
+    text, marker, payload = (chat_text or "").partition(ARTIFACT_MARKER)
+    if not marker or not payload.endswith(ARTIFACT_END):
+        return chat_text, []
+    try:
+        return text, json.loads(payload[:-len(ARTIFACT_END)])
+    except ValueError:
+        return chat_text, []
+
+
+def _value(value) -> str:
+    if value is None or value == "":
+        return "—"
+    icon = FIELD_ICONS.get(str(value))
+    return f"{icon} {value}" if icon else str(value)
+
+
+def render_artifact(artifact: dict):
+    """
+    Render one tool result: a dataframe for lists and a card for a single record.
+
+    :param artifact: Artifact built by utils.tool_output
+    """
+    if artifact.get("kind") == "table":
+        st.caption(artifact.get("title", ""))
+        df = pd.DataFrame(artifact["rows"], columns=artifact.get("columns"))
+        st.dataframe(df, hide_index=True, use_container_width=True)
+
+    elif artifact.get("kind") == "record":
+        with st.container(border=True):
+            st.markdown(f"**{artifact.get('title', '')}**")
+            cols = st.columns(2)
+            for i, (key, value) in enumerate(artifact["record"].items()):
+                cols[i % 2].markdown(f"**{key.replace('_', ' ').title()}:** {_value(value)}")
+
+
+def render_message(content: str, artifacts: list = None):
+    """
+    Render a chat message followed by its tool results.
+
+    :param content: Markdown text of the message
+    :param artifacts: Artifacts attached to the message
+    """
+    if content:
+        st.markdown(content)
+    for artifact in artifacts or []:
+        render_artifact(artifact)
@@ -0,0 +1,113 @@
+import os
+import re
+import time
+
+import ormsgpack
+import zstandard
+
+DEFAULT_SNAPSHOT_DIR = "snapshots"
+
+# A snapshot this recent is resumed at login, older ones are left for a fresh chat.
+RESUME_SECONDS = 30 * 60
+
+# Snapshots kept per employee, older chats are removed when a new one is saved.
+MAX_SNAPSHOTS = 20
+
+# Bump when the layout of the saved state changes; snapshots of another version are ignored.
+VERSION = 1
+
+SUFFIX = ".msgpack.zst"
+
+_compressor = zstandard.ZstdCompressor(level=3)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def _dir(emp) -> str:
+    root = os.environ.get("CRM_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+    return os.path.join(root, re.sub(r"[^\w-]", "_", str(emp)))
+
+
+def _path(emp, chat_id) -> str:
+    return os.path.join(_dir(emp), f"{int(chat_id)}{SUFFIX}")
+
+
+def save(emp, chat_id, state: dict) -> bool:
+    """
+    Write the state of a chat as zstd compressed msgpack. The file is replaced atomically, a crash never
+    leaves half a snapshot behind.
+
+    :param emp: current_emp
+    :param chat_id: live_chat_id
+    :param state: msgpack serializable agent state, see GeminiAssistant.snapshot
+    :return: False if the snapshot could not be written
+    """
+    if chat_id is None:
+        return False
+    path = _path(emp, chat_id)
+    try:
+        data = _compressor.compress(ormsgpack.packb({"version": VERSION, "saved_at": time.time(), **state},
+                                                    default=str))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        _prune(emp)
+        return True
+    except (OSError, TypeError, ormsgpack.MsgpackEncodeError):
+        return False
+
+
+def load(emp, chat_id):
+    """
+    :return: State saved for the chat, None if there is none or it cannot be read
+    """
+    try:
+        with open(_path(emp, chat_id), "rb") as f:
+            state = ormsgpack.unpackb(_decompressor.decompress(f.read()))
+    except (OSError, ValueError, zstandard.ZstdError):
+        return None
+    return state if isinstance(state, dict) and state.get("version") == VERSION else None
+
+
+def _snapshots(emp) -> list:
+    """
+    :return: [(mtime, chat_id)] of an employee, newest first
+    """
+    try:
+        names = os.listdir(_dir(emp))
+    except OSError:
+        return []
+    found = []
+    for name in names:
+        if name.endswith(SUFFIX) and name[:-len(SUFFIX)].isdigit():
+            try:
+                found.append((os.path.getmtime(os.path.join(_dir(emp), name)), int(name[:-len(SUFFIX)])))
+            except OSError:
+                continue
+    return sorted(found, reverse=True)
+
+
+def load_latest(emp):
+    """
+    The chat the employee was in last, if it was saved within RESUME_SECONDS.
+
+    :return: (chat_id, state) or None
+    """
+    for mtime, chat_id in _snapshots(emp)[:1]:
+        if time.time() - mtime <= RESUME_SECONDS:
+            state = load(emp, chat_id)
+            if state is not None:
+                return chat_id, state
+    return None
+
+
+def remove(emp, chat_id):
+    try:
+        os.remove(_path(emp, chat_id))
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def _prune(emp):
+    for _, chat_id in _snapshots(emp)[MAX_SNAPSHOTS:]:
+        remove(emp, chat_id)
@@ -0,0 +1,346 @@
+import heapq
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+import streamlit as st
+
+from utils import crm_client as crm
+from utils import filters as flt
+from utils.name_index import normalize, scope
+
+# How long the index is trusted before it is rebuilt in the background. Writes made through the tools are
+# applied immediately, this only bounds how stale changes made elsewhere can get.
+REFRESH_SECONDS = 600
+
+# Indexes kept, one per scope. The least recently used are dropped and rebuilt when needed again.
+MAX_INDEXES = 32
+
+# After a failed first load, searches of the scope fall back to the API for this long before it is retried.
+RETRY_SECONDS = 30
+
+# BM25 parameters. A title word counts TITLE_WEIGHT times, titles say what a ticket is about.
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 2
+
+# Hits returned when the caller does not ask for a number.
+DEFAULT_TOP_K = 20
+
+# Fields kept per ticket for the result table. All but id and title are also filterable.
+CODED_FIELDS = ("status", "priority", "ticket_type", "customer_id", "assignee_id", "created_by_id")
+KEPT_FIELDS = ("ticket_id", "title") + CODED_FIELDS
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is", "it", "its", "of",
+    "on", "or", "that", "the", "this", "to", "was", "were", "will", "with", "not", "no", "cannot", "can", "does",
+}
+
+
+def tokenize(text: str) -> list:
+    """
+    Normalized words without stop words; a plural "s" is dropped so "errors" finds "error".
+    """
+    words = []
+    for word in normalize(text).split():
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+class TicketTextIndex:
+    """
+    Inverted index over ticket titles and descriptions, ranked with BM25.
+
+    The tickets loaded by build() form a base segment held in numpy arrays: per term the positions of the
+    tickets containing it with their precomputed BM25 term weight, and per filter field an integer code per
+    ticket. Scoring and filtering the base is vectorized. Tickets written afterwards go to a small delta
+    segment of plain dicts and hide their base copy, until the next build folds them in.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built_at = None
+        self._pending = None
+        self.build([], stamp=False)
+
+    def record_writes(self):
+        """
+        Remember the tickets upserted from now on, so build() can replay the writes that raced the load of
+        its data.
+        """
+        with self._lock:
+            self._pending = []
+
+    def drop_writes(self):
+        """
+        Stop remembering upserted tickets, after a load that did not lead to a build().
+        """
+        with self._lock:
+            self._pending = None
+
+    def build(self, tickets: list, stamp: bool = True):
+        """
+        Replace the index with the given tickets. The heavy work happens outside the lock, searches keep
+        using the previous data meanwhile.
+        """
+        postings = {}
+        doc_len = []
+        ids, titles = [], []
+        values = {field: {} for field in CODED_FIELDS}
+        codes = {field: [] for field in CODED_FIELDS}
+
+        for ticket in tickets:
+            if not isinstance(ticket, dict) or ticket.get("ticket_id") is None:
+                continue
+            pos = len(ids)
+            ids.append(ticket["ticket_id"])
+            titles.append(ticket.get("title"))
+            for field in CODED_FIELDS:
+                value = ticket.get(field)
+                codes[field].append(-1 if value is None else values[field].setdefault(value, len(values[field])))
+            terms = _terms(ticket.get("title"), ticket.get("description"))
+            doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                positions = postings.setdefault(term, ([], []))
+                positions[0].append(pos)
+                positions[1].append(tf)
+
+        doc_len = np.asarray(doc_len, dtype=np.float32)
+        avg_len = float(doc_len.mean()) if len(doc_len) else 1.0
+        base = {}
+        for term, (positions, tfs) in postings.items():
+            positions = np.asarray(positions, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            base[term] = (positions, tfs * (K1 + 1) / (tfs + K1 * (1 - B + B * doc_len[positions] / avg_len)))
+
+        with self._lock:
+            self._base = base
+            self._ids = np.asarray(ids, dtype=np.int64)
+            self._pos = {ticket_id: pos for pos, ticket_id in enumerate(ids)}
+            self._titles = titles
+            self._values = {field: list(v) for field, v in values.items()}
+            self._lookup = {field: {_key(field, value): code for value, code in v.items()}
+                            for field, v in values.items()}
+            self._codes = {field: np.asarray(c, dtype=np.int32) for field, c in codes.items()}
+            self._alive = np.ones(len(ids), dtype=bool)
+            self._avg_len = avg_len
+            self._delta = {}
+            self._delta_terms = {}
+            if stamp:
+                self.built_at = time.monotonic()
+            pending, self._pending = self._pending or [], None
+            for ticket in pending:
+                self.upsert(ticket)
+
+    def upsert(self, ticket: dict):
+        """
+        Index a ticket as returned by the API, or re-index it after an update. Fields missing from a partial
+        record are taken from the indexed copy; a missing description is treated as empty.
+        """
+        if not isinstance(ticket, dict) or ticket.get("ticket_id") is None:
+            return
+        ticket_id = ticket["ticket_id"]
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(ticket)
+            old = self._record(ticket_id)
+            if old:
+                ticket = {**old, **ticket}
+            self.remove(ticket_id)
+            self._delta[ticket_id] = {f: ticket.get(f) for f in KEPT_FIELDS}
+            self._delta_terms[ticket_id] = _terms(ticket.get("title"), ticket.get("description"))
+
+    def remove(self, ticket_id):
+        with self._lock:
+            pos = self._pos.get(ticket_id)
+            if pos is not None:
+                self._alive[pos] = False
+            self._delta.pop(ticket_id, None)
+            self._delta_terms.pop(ticket_id, None)
+
+    def _record(self, ticket_id):
+        if ticket_id in self._delta:
+            return self._delta[ticket_id]
+        pos = self._pos.get(ticket_id)
+        if pos is None or not self._alive[pos]:
+            return None
+        return self._base_record(pos)
+
+    def _base_record(self, pos: int) -> dict:
+        record = {"ticket_id": int(self._ids[pos]), "title": self._titles[pos]}
+        for field in CODED_FIELDS:
+            code = self._codes[field][pos]
+            record[field] = self._values[field][code] if code >= 0 else None
+        return record
+
+    def search(self, text: str, filters: dict = None, k: int = DEFAULT_TOP_K) -> tuple:
+        """
+        :param text: Keywords, e.g. "login error on mobile"
+        :param filters: Structured filters (status, priority, ticket_type, assignee_id, customer_id, ...)
+        :param k: Number of hits to return
+        :return: (total, hits) - the number of matching tickets, and the best k of them, highest `score` first
+        """
+        terms = set(tokenize(text))
+        query = flt.build_query(filters or {}, flt.TICKET_FILTERS)
+        query.pop("title", None)
+        query.pop("description", None)
+        if not terms:
+            return 0, []
+
+        with self._lock:
+            n = int(self._alive.sum()) + len(self._delta)
+            if not n:
+                return 0, []
+            idf = {}
+            for term in terms:
+                df = (int(self._alive[self._base[term][0]].sum()) if term in self._base else 0) + \
+                     sum(1 for t in self._delta_terms.values() if term in t)
+                if df:
+                    idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+            # Base segment.
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term, weight in idf.items():
+                if term in self._base:
+                    positions, weights = self._base[term]
+                    scores[positions] += weight * weights
+            mask = self._alive & (scores > 0)
+            for field, wanted in query.items():
+                code = self._lookup[field].get(_key(field, wanted)) if field in self._codes else None
+                if code is None:
+                    mask[:] = False
+                    break
+                mask &= self._codes[field] == code
+            candidates = np.flatnonzero(mask)
+            total = len(candidates)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+            hits = [(float(scores[pos]), self._base_record(pos)) for pos in candidates]
+
+            # Delta segment.
+            for ticket_id, doc_terms in self._delta_terms.items():
+                record = self._delta[ticket_id]
+                length = sum(doc_terms.values())
+                score = sum(
+                    weight * doc_terms[term] * (K1 + 1) /
+                    (doc_terms[term] + K1 * (1 - B + B * length / self._avg_len))
+                    for term, weight in idf.items() if term in doc_terms
+                )
+                if score > 0 and (not query or flt.matches(record, query, flt.TICKET_FILTERS)):
+                    hits.append((score, record))
+                    total += 1
+
+        best = heapq.nlargest(k, hits, key=lambda hit: (hit[0], -hit[1]["ticket_id"]))
+        return total, [{**record, "score": round(score, 3)} for score, record in best]
+
+    def __len__(self):
+        return int(self._alive.sum()) + len(self._delta)
+
+
+def _terms(title, description) -> Counter:
+    terms = Counter()
+    for word in tokenize(title):
+        terms[word] += TITLE_WEIGHT
+    terms.update(tokenize(description))
+    return terms
+
+
+def _key(field: str, value):
+    """
+    Comparison key of a filter value, following the match mode of the field in flt.TICKET_FILTERS.
+    """
+    value = str(getattr(value, "value", value))
+    return value.casefold() if flt.TICKET_FILTERS[field] == "iexact" else value
+
+
+# Auth scope -> its index, the lock its first load is made under and when that load last failed, and the
+# scopes whose index is being rebuilt. See name_index.scope.
+_indexes = OrderedDict()
+_loading = {}
+_failed = {}
+_refreshing = set()
+_lock = threading.Lock()
+
+
+def _load(client, headers) -> list:
+    # Plain GET, the whole collection is not worth a place in the entity cache.
+    res = client.get("/tickets/", headers=headers)
+    data = res.json()
+    if not isinstance(data, list):
+        raise ValueError(f"Could not load tickets - {data}")
+    return data
+
+
+def _refresh(key: str, index: TicketTextIndex, client, headers):
+    try:
+        index.record_writes()
+        index.build(_load(client, headers))
+    except Exception:
+        # Keep serving the current data, the next search past REFRESH_SECONDS tries again.
+        index.drop_writes()
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def get_index() -> TicketTextIndex:
+    """
+    The ticket index shared by the sessions of the current auth scope. The first call of a scope builds it
+    with the session's headers; once it is older than REFRESH_SECONDS it keeps answering while a background
+    thread rebuilds it.
+    """
+    client = crm.get_client()
+    headers = st.session_state.get("headers", {})
+    key = scope()
+    with _lock:
+        if key not in _indexes:
+            _indexes[key] = TicketTextIndex()
+            _loading[key] = threading.Lock()
+        index = _indexes[key]
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_INDEXES:
+            old, _ = _indexes.popitem(last=False)
+            _loading.pop(old, None)
+            _failed.pop(old, None)
+        stale = index.built_at is not None and time.monotonic() - index.built_at > REFRESH_SECONDS and \
+            key not in _refreshing
+        if stale:
+            _refreshing.add(key)
+    if index.built_at is None:
+        _first_load(key, index, client, headers)
+    elif stale:
+        threading.Thread(target=_refresh, args=(key, index, client, headers), name="crm-text-index",
+                         daemon=True).start()
+    return index
+
+
+def _first_load(key: str, index: TicketTextIndex, client, headers):
+    # Only sessions of the same scope wait for the download, and a failing API is not asked again by every
+    # search: until RETRY_SECONDS have passed they fall back to the API search right away.
+    with _loading[key]:
+        if index.built_at is not None:
+            return
+        if time.monotonic() - _failed.get(key, float("-inf")) < RETRY_SECONDS:
+            raise ValueError("The ticket index could not be loaded, try again later")
+        try:
+            index.build(_load(client, headers))
+        except Exception:
+            _failed[key] = time.monotonic()
+            raise
+        _failed.pop(key, None)
+
+
+def upsert(ticket: dict):
+    """
+    Keep the index of the current scope up to date after a create or update. Does nothing until it has been
+    built; indexes of other scopes pick the change up at their next rebuild.
+    """
+    index = _indexes.get(scope())
+    if index is not None and index.built_at is not None:
+        index.upsert(ticket)
@@ -0,0 +1,195 @@
+import threading
+
+from utils import tracing
+
+# Long free text fields (descriptions, ...) are cut to this many characters in tabular output.
+MAX_TEXT = 80
+
+# Rows kept in a table rendered for the user. Tables are persisted with the chat, so they stay bounded.
+MAX_ARTIFACT_ROWS = 500
+
+# Rows of a search result sent to the model. The full result is in the table shown to the user.
+MAX_MODEL_ROWS = 20
+
+SHOWN_TABLE = "These rows are already shown to the user as a table. Do NOT repeat them, only write a short " \
+              "summary of one or two sentences."
+SHOWN_RECORD = "This record is already shown to the user as a card. Do NOT repeat its fields, only write a short " \
+               "summary of one or two sentences."
+
+TICKET_COLUMNS = ["ticket_id", "title", "status", "priority", "ticket_type"]
+CUSTOMER_COLUMNS = ["customer_id", "first_name", "last_name", "email", "created_by"]
+EMPLOYEE_COLUMNS = ["employee_id", "first_name", "last_name", "access_level"]
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _cell(value, max_text: int) -> str:
+    if value is None:
+        return ""
+    text = " ".join(str(getattr(value, "value", value)).split())
+    if max_text and len(text) > max_text:
+        text = text[:max_text - 1] + "…"
+    return text
+
+
+def _columns(rows: list, wanted: list = None) -> list:
+    present = list(dict.fromkeys(key for row in rows for key in row))
+    if wanted:
+        projected = [column for column in wanted if column in present]
+        if projected:
+            return projected
+    return present
+
+
+def _record(tool: str, raw: int, encoded: int):
+    with _lock:
+        entry = _stats.setdefault(tool, {"calls": 0, "raw_bytes": 0, "encoded_bytes": 0})
+        entry["calls"] += 1
+        entry["raw_bytes"] += raw
+        entry["encoded_bytes"] += encoded
+
+
+def encode_rows(tool: str, rows: list, columns: list = None, max_text: int = MAX_TEXT) -> str:
+    """
+    Encode a list of records as a tab separated table with a single header line.
+
+    :param tool: Name of the tool producing the output, used for the size statistics
+    :param rows: Records as returned by the API
+    :param columns: Columns to keep, in order. Missing ones are skipped; all columns are kept if none match.
+    :param max_text: Maximum length of a single cell, 0 to disable truncation
+    :return: Table text
+    """
+    if not isinstance(rows, list):
+        return str(rows)
+    rows = [row for row in rows if isinstance(row, dict)]
+    if not rows:
+        return "(no rows)"
+
+    header = _columns(rows, columns)
+    lines = ["\t".join(header)]
+    lines += ["\t".join(_cell(row.get(column), max_text) for column in header) for row in rows]
+    table = "\n".join(lines)
+
+    _record(tool, len(repr(rows).encode()), len(table.encode()))
+    return table
+
+
+def encode_record(tool: str, record: dict, max_text: int = 0) -> str:
+    """
+    Encode a single record as `key: value` lines.
+
+    :param tool: Name of the tool producing the output, used for the size statistics
+    :param record: Record as returned by the API
+    :param max_text: Maximum length of a single value, 0 to disable truncation
+    :return: Record text
+    """
+    if not isinstance(record, dict):
+        return str(record)
+
+    text = "\n".join(f"{key}: {_cell(value, max_text)}" for key, value in record.items())
+    _record(tool, len(repr(record).encode()), len(text.encode()))
+    return text
+
+
+def describe(entity: str, filters: dict) -> str:
+    """
+    Human readable caption for a filtered result, e.g. "Tickets - status: Open, priority: High".
+    """
+    if not filters:
+        return entity
+    return f"{entity} - " + ", ".join(f"{k}: {getattr(v, 'value', v)}" for k, v in filters.items())
+
+
+def table_artifact(title: str, rows: list, columns: list = None, total: int = None, page: int = None):
+    """
+    Structured result rendered by the chat view as a table.
+
+    :param title: Caption of the table
+    :param rows: Records as returned by the API
+    :param columns: Columns to show, in order
+    :param total: Number of matches, which may exceed the rows kept; defaults to the number of rows
+    :param page: Page number when the rows are one page of a collection
+    :return: Artifact dict, None if there is nothing to show
+    """
+    if isinstance(rows, list) and total is None:
+        total = len(rows)
+    if not isinstance(rows, list):
+        return None
+    rows = [row for row in rows if isinstance(row, dict)][:MAX_ARTIFACT_ROWS]
+    if not rows:
+        return None
+    header = _columns(rows, columns)
+    return {
+        "kind": "table",
+        "title": title,
+        "columns": header,
+        "rows": [{column: row.get(column) for column in header} for row in rows],
+        "total": total,
+        "page": page
+    }
+
+
+def search_result(tool: str, entity: str, filters: dict, rows: list, columns: list):
+    """
+    Tool output of a filtered search: the number of matches and the first MAX_MODEL_ROWS of them for the
+    model, all of them (up to MAX_ARTIFACT_ROWS) in the table shown to the user.
+
+    :param tool: Name of the tool producing the output, used for the size statistics
+    :param entity: Plural entity name, e.g. "Tickets"
+    :param filters: Filters given to the tool
+    :param rows: Matching records
+    :param columns: Columns to keep, in order
+    :return: (content, artifact)
+    """
+    if not isinstance(rows, list):
+        return f"The API could not give {entity.lower()} for {filters} - {rows}", None
+    table = encode_rows(tool, rows[:MAX_MODEL_ROWS], columns)
+    shown = f"the first {MAX_MODEL_ROWS}" if len(rows) > MAX_MODEL_ROWS else "all of them"
+    content = f"Found {len(rows)} {entity.lower()} matching {filters}; {shown}, tab separated with a header " \
+              f"line -\n{table}\n{SHOWN_TABLE}"
+    return content, table_artifact(describe(entity, filters), rows, columns, total=len(rows))
+
+
+def record_artifact(title: str, record: dict):
+    """
+    Structured result rendered by the chat view as a card.
+
+    :param title: Title of the card
+    :param record: Record as returned by the API
+    :return: Artifact dict, None for error bodies
+    """
+    if not isinstance(record, dict) or "detail" in record:
+        return None
+    return {"kind": "record", "title": title, "record": record}
+
+
+def encoding_stats() -> dict:
+    """
+    Prompt size saved by the encoding, per tool. Tokens are estimated at 4 bytes per token.
+
+    :return: tool -> {calls, raw_bytes, encoded_bytes, saved_bytes, saved_tokens, ratio}
+    """
+    with _lock:
+        return {
+            tool: {
+                **entry,
+                "saved_bytes": entry["raw_bytes"] - entry["encoded_bytes"],
+                "saved_tokens": (entry["raw_bytes"] - entry["encoded_bytes"]) // 4,
+                "ratio": entry["raw_bytes"] / entry["encoded_bytes"] if entry["encoded_bytes"] else 0.0
+            }
+            for tool, entry in _stats.items()
+        }
+
+
+def _metrics() -> list:
+    stats = sorted(encoding_stats().items())
+    return [
+        ("crm_tool_output_calls_total", "counter", "Tool results encoded for the model.",
+         [({"tool": tool}, s["calls"]) for tool, s in stats]),
+        ("crm_tool_output_bytes_total", "counter", "Size of tool results before and after encoding.",
+         [({"tool": tool, "form": form}, s[f"{form}_bytes"]) for tool, s in stats for form in ("raw", "encoded")]),
+    ]
+
+
+tracing.add_metrics(_metrics)
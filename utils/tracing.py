@@ -0,0 +1,216 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Share of turns whose spans are written to the JSONL sink. Metrics are kept for every span.
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_TRACE_FILE = os.path.join("logs", "traces.jsonl")
+
+# Upper bounds (seconds) of the duration histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current = contextvars.ContextVar("crm_span", default=None)
+
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+_histograms = {}
+_metric_sources = []
+_metrics_server = None
+
+
+def sample_rate() -> float:
+    """
+    `CRM_TRACE_SAMPLE` env variable, between 0 (no traces written) and 1 (every turn).
+    """
+    try:
+        return min(max(float(os.environ.get("CRM_TRACE_SAMPLE", DEFAULT_SAMPLE_RATE)), 0.0), 1.0)
+    except ValueError:
+        return DEFAULT_SAMPLE_RATE
+
+
+class Span:
+    """
+    One timed operation: a turn, an LLM call, a tool call or an HTTP request. Spans started while another
+    one is current become its children and share its trace.
+    """
+
+    def __init__(self, name: str, kind: str, parent: "Span" = None, **attrs):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.sampled = parent.sampled if parent else random.random() < sample_rate()
+        self.attrs = attrs
+        self.status = "ok"
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+        # Finished spans of the trace, written together when the root span ends.
+        self.finished = [] if parent is None else None
+        self.closed = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        self.status = "error"
+        self.error = str(error)[:300]
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name, "kind": self.kind, "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3), "status": self.status, "error": self.error,
+            **self.attrs,
+        }
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, kind: str, **attrs):
+    """
+    Time the enclosed block as a span. Exceptions mark the span as failed and are re-raised.
+
+    :param name: Operation, e.g. the tool name or the normalized HTTP route
+    :param kind: "turn", "llm", "tool" or "http"
+    :param attrs: Extra fields stored with the span, e.g. payload sizes
+    :return: The span, attributes can be added while it runs
+    """
+    s = Span(name, kind, _current.get(), **attrs)
+    token = _current.set(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            s.fail(e)
+        raise
+    finally:
+        s.duration = time.perf_counter() - start
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A generator closed from another context, e.g. a streamed turn abandoned by the page.
+            _current.set(s.parent)
+        _finish(s)
+
+
+def _finish(s: Span):
+    _observe(s.kind, s.name, s.status, s.duration)
+    if not s.sampled:
+        return
+    root = s.root
+    with _lock:
+        if s is not root and not root.closed:
+            root.finished.append(s)
+            return
+        lines = [s] if s is not root else root.finished + [root]
+        root.closed = True
+    _write(lines)
+
+
+def _write(spans: list):
+    path = os.environ.get("CRM_TRACE_FILE", DEFAULT_TRACE_FILE)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _file_lock, open(path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(s.to_dict(), default=str) + "\n" for s in spans)
+    except OSError:
+        pass
+
+
+def _observe(kind: str, name: str, status: str, duration: float):
+    with _lock:
+        h = _histograms.get((kind, name, status))
+        if h is None:
+            h = _histograms[(kind, name, status)] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+        h["count"] += 1
+        h["sum"] += duration
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                h["buckets"][i] += 1
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def add_metrics(source):
+    """
+    Expose more metrics on /metrics.
+
+    :param source: Callable returning [(name, type, help, [(labels dict, value)])], called on every scrape
+    """
+    with _lock:
+        _metric_sources.append(source)
+
+
+def prometheus_text() -> str:
+    """
+    :return: Span durations and the metrics of add_metrics in the Prometheus text exposition format
+    """
+    lines = [
+        "# HELP crm_span_duration_seconds Duration of turns, LLM calls, tool calls and CRM requests.",
+        "# TYPE crm_span_duration_seconds histogram",
+    ]
+    with _lock:
+        items = sorted((key, {**h, "buckets": list(h["buckets"])}) for key, h in _histograms.items())
+        sources = list(_metric_sources)
+    for (kind, name, status), h in items:
+        labels = f'kind="{_label(kind)}",name="{_label(name)}",status="{_label(status)}"'
+        for bound, count in zip(BUCKETS, h["buckets"]):
+            lines.append(f'crm_span_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'crm_span_duration_seconds_bucket{{{labels},le="+Inf"}} {h["count"]}')
+        lines.append(f"crm_span_duration_seconds_sum{{{labels}}} {h['sum']:.6f}")
+        lines.append(f"crm_span_duration_seconds_count{{{labels}}} {h['count']}")
+    for source in sources:
+        for name, kind, description, samples in source():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labels = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode()
+        self.send_response(200 if self.path.rstrip("/") in ("", "/metrics") else 404)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server():
+    """
+    Serve /metrics on the port in the `CRM_METRICS_PORT` env variable, once per process. Does nothing if
+    the variable is not set.
+    """
+    global _metrics_server
+    port = os.environ.get("CRM_METRICS_PORT")
+    with _lock:
+        if _metrics_server is not None or not port:
+            return
+        try:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+        except (OSError, ValueError):
+            _metrics_server = False
+            return
+    threading.Thread(target=_metrics_server.serve_forever, name="crm-metrics", daemon=True).start()
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import deque
+
+# Finished turns kept for the export, across all sessions of the process.
+MAX_TURNS = 2000
+
+_lock = threading.Lock()
+_by_session = {}
+_by_employee = {}
+_by_tool = {}
+_turns = deque(maxlen=MAX_TURNS)
+
+
+def _totals() -> dict:
+    return {"turns": 0, "llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+
+
+def new_turn(prompt: str, emp=None, chat_id=None) -> dict:
+    """
+    Start collecting the usage of one turn.
+
+    :param prompt: The user Query
+    :param emp: current_emp
+    :param chat_id: live_chat_id
+    :return: Turn record, filled by add_call / add_tool and closed by finish_turn
+    """
+    return {**_totals(), "turns": 1, "time": time.time(), "emp": emp, "chat_id": chat_id,
+            "prompt": prompt[:120], "models": [], "tools": {}, "unpriced": False}
+
+
+def add_call(turn: dict, model: str, usage_metadata: dict, price):
+    """
+    Account one LLM call.
+
+    :param turn: Record from new_turn
+    :param model: Model name
+    :param usage_metadata: usage_metadata of the AI message, may be None
+    :param price: (input, output) USD per million tokens, None if the model has no price
+    """
+    usage_metadata = usage_metadata or {}
+    input_tokens = usage_metadata.get("input_tokens", 0)
+    output_tokens = usage_metadata.get("output_tokens", 0)
+    turn["llm_calls"] += 1
+    turn["input_tokens"] += input_tokens
+    turn["output_tokens"] += output_tokens
+    if model not in turn["models"]:
+        turn["models"].append(model)
+    if price:
+        turn["cost_usd"] += (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+    else:
+        turn["unpriced"] = True
+
+
+def add_tool(turn: dict, name: str, result_tokens: int):
+    """
+    Account a tool result. Its tokens are part of the input of every later LLM call of the session.
+
+    :param turn: Record from new_turn
+    :param name: Tool name
+    :param result_tokens: Estimated tokens of the result sent to the model
+    """
+    tool = turn["tools"].setdefault(name, {"calls": 0, "result_tokens": 0})
+    tool["calls"] += 1
+    tool["result_tokens"] += result_tokens
+
+
+def _add(totals: dict, turn: dict):
+    for key in ("turns", "llm_calls", "input_tokens", "output_tokens", "cost_usd"):
+        totals[key] += turn[key]
+
+
+def finish_turn(turn: dict):
+    """
+    Add a finished turn to the session, employee and tool totals.
+    """
+    with _lock:
+        _add(_by_session.setdefault(turn["chat_id"], _totals()), turn)
+        _add(_by_employee.setdefault(turn["emp"], _totals()), turn)
+        for name, tool in turn["tools"].items():
+            totals = _by_tool.setdefault((turn["emp"], name), {"calls": 0, "result_tokens": 0})
+            totals["calls"] += tool["calls"]
+            totals["result_tokens"] += tool["result_tokens"]
+        _turns.append(turn)
+
+
+def session_usage(chat_id) -> dict:
+    with _lock:
+        return dict(_by_session.get(chat_id, _totals()))
+
+
+def employee_usage(emp) -> dict:
+    with _lock:
+        return dict(_by_employee.get(emp, _totals()))
+
+
+def _tool_totals(emp=None) -> dict:
+    tools = {}
+    for (tool_emp, name), v in _by_tool.items():
+        if emp is None or tool_emp == emp:
+            totals = tools.setdefault(name, {"calls": 0, "result_tokens": 0})
+            totals["calls"] += v["calls"]
+            totals["result_tokens"] += v["result_tokens"]
+    return dict(sorted(tools.items(), key=lambda item: item[1]["result_tokens"], reverse=True))
+
+
+def export(emp=None) -> dict:
+    """
+    :param emp: Only include the turns of this employee, None for everything
+    :return: Totals per session, employee and tool, and the recent turns
+    """
+    with _lock:
+        turns = [t for t in _turns if emp is None or t["emp"] == emp]
+        sessions = {t["chat_id"] for t in turns}
+        return {
+            "employees": {str(e): dict(v) for e, v in _by_employee.items() if emp is None or e == emp},
+            "sessions": {str(s): dict(v) for s, v in _by_session.items() if emp is None or s in sessions},
+            "tools": _tool_totals(emp),
+            "turns": [dict(t) for t in turns],
+        }
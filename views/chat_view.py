@@ -1,6 +1,12 @@
+import json
+
 import streamlit as st
+from ai_core import providers
 from ai_core.agent import GeminiAssistant
 from utils import chat_helpers as ch
+from utils import render
+from utils import snapshots
+from utils import usage
 
 st.set_page_config(layout="wide", page_title="AI CRM Assistant")
 st.title("AI Assistant")
@@ -8,11 +14,15 @@ st.title("AI Assistant")
 # initialize agent for this chat session
 if "agent" not in st.session_state:
     st.session_state["agent"] = GeminiAssistant()
+    # After a reload or restart, continue the chat the employee was in if it was saved recently.
+    resumed = snapshots.load_latest(st.session_state.current_emp)
+    if resumed:
+        chat_id, state = resumed
+        st.session_state["agent"].restore(state)
+        st.session_state["live_chat_id"] = chat_id
+        st.session_state["active_view_id"] = chat_id
 
-MODEL_OPTIONS = {
-    "Gemini": ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-3-flash"],
-    "Groq": ["llama-3.3-70b-versatile", "qwen/qwen3-32b"]
-}
+MODEL_OPTIONS = providers.model_options()
 
 # Fetch the new chat ID created for this session and mark it active
 if "live_chat_id" not in st.session_state:
@@ -20,17 +30,13 @@ if "live_chat_id" not in st.session_state:
     st.session_state["live_chat_id"] = new_id
     st.session_state["active_view_id"] = new_id
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-if "loaded_chat_id" not in st.session_state:
-    st.session_state["loaded_chat_id"] = None
-
 live_id = st.session_state["live_chat_id"]
 active_id = st.session_state["active_view_id"]
 
 with st.sidebar:
     st.title(st.session_state.current_emp_name)
+    if st.button("Logout", icon=":material/logout:", use_container_width=True):
+        ch.logout()
     st.title("Chats")
 
     is_live = (active_id == live_id)
@@ -44,7 +50,7 @@ with st.sidebar:
         st.write("Configuration")
         selected_provider = st.selectbox(
             "AI Provider",
-            options=["Gemini", "Groq"],
+            options=providers.names(),
             index=0,
             key="temp_provider_selection"
         )
@@ -67,42 +73,61 @@ with st.sidebar:
                 api_key=api_key_input
             )
 
+    with st.popover("Usage", icon=":material/data_usage:", width="stretch"):
+        for label, totals in (("This chat", usage.session_usage(live_id)),
+                              ("All your chats", usage.employee_usage(st.session_state.current_emp))):
+            st.caption(f"{label} - {totals['turns']} turns, {totals['llm_calls']} LLM calls")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Input tokens", f"{totals['input_tokens']:,}")
+            c2.metric("Output tokens", f"{totals['output_tokens']:,}")
+            c3.metric("Cost", f"${totals['cost_usd']:.4f}")
+
+        report = usage.export(st.session_state.current_emp)
+        if report["tools"]:
+            st.caption("Context added by tool results")
+            st.dataframe([{"tool": name, **t} for name, t in report["tools"].items()], hide_index=True)
+        st.download_button("Export", data=json.dumps(report, default=str, indent=2),
+                           file_name=f"usage_{st.session_state.current_emp}.json", mime="application/json",
+                           use_container_width=True)
+
     st.divider()
 
-    sessions = ch.get_user_chats()
-    sessions.sort(key=lambda x: x['chat_id'], reverse=True)
+    summaries = ch.get_session_summaries()
 
-    for session in sessions:
+    for session in summaries["items"]:
         s_id = session['chat_id']
 
         if s_id == live_id:
             continue
 
-        msgs = ch.get_chat_messages(s_id)
-        if len(msgs) < 2:
+        if session.get('message_count', 0) < 2:
             continue
 
-        s_title = session['init_time'] or f"Chat {s_id}"
+        s_title = session.get('title') or session.get('init_time') or f"Chat {s_id}"
         b_type = "primary" if active_id == s_id else "secondary"
 
         if st.button(s_title, key=s_id, use_container_width=True, type=b_type):
             st.session_state["active_view_id"] = s_id
             st.rerun()
 
-# Add messages for the current chat to session state
-if st.session_state["loaded_chat_id"] != active_id:
-    raw_msgs = ch.get_chat_messages(active_id)
-    st.session_state.messages = []
-    for m in raw_msgs:
-        role = "user" if m['sender_type'] == "user" else "ai"
-        st.session_state.messages.append({"role": role, "content": m['chat_text']})
+    if summaries["has_more"]:
+        if st.button("Load more", use_container_width=True):
+            ch.load_more_sessions()
+            st.rerun()
+
+# Newest messages of the active chat, cached per chat. New messages are appended to the same list.
+window = ch.get_chat_window(active_id)
+st.session_state.messages = window["messages"]
 
-    st.session_state["loaded_chat_id"] = active_id
+if window["has_more"]:
+    if st.button("Load older messages", icon=":material/history:", use_container_width=True):
+        ch.load_older_messages(active_id)
+        st.rerun()
 
 # Display all messages for this chat session
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+        render.render_message(message["content"], message.get("artifacts"))
 
 # Show the prompt input bar only if user is currently in active session
 if active_id == live_id:
@@ -115,12 +140,29 @@ if active_id == live_id:
         ch.send_message("user", prompt, active_id)
 
         with st.chat_message("ai"):
-            with st.spinner("Loading..."):
-                ai_response = llm.send_message(prompt)
-                if ai_response:
-                    st.markdown(ai_response)
-
-                    st.session_state.messages.append({"role": "ai", "content": ai_response})
-                    ch.send_message("ai", ai_response, active_id)
+            progress = {"status": None, "artifacts": []}
+
+            def answer_tokens():
+                # Show tool progress in a status box and hand the answer text over to write_stream.
+                for event in llm.stream_message(prompt):
+                    if event["type"] == "tool":
+                        if progress["status"] is None:
+                            progress["status"] = st.status("Working on it...")
+                        progress["status"].write(f"Running `{event['name']}`")
+                    elif event["type"] == "artifact":
+                        progress["artifacts"].append(event["artifact"])
+                    else:
+                        yield event["text"]
+                if progress["status"] is not None:
+                    progress["status"].update(label="Done", state="complete", expanded=False)
+
+            ai_response = st.write_stream(answer_tokens())
+            artifacts = progress["artifacts"]
+            for artifact in artifacts:
+                render.render_artifact(artifact)
+            if ai_response:
+                st.session_state.messages.append({"role": "ai", "content": ai_response, "artifacts": artifacts})
+                ch.send_message("ai", render.encode_message(ai_response, artifacts), active_id)
+            snapshots.save(st.session_state.current_emp, active_id, llm.snapshot())
 else:
     st.info("This is a past conversation. Chat is disabled.")